@@ -0,0 +1,93 @@
+"""Stand-in for the albert module, enough to run the plugins outside Albert.
+
+Items and actions just keep their arguments, detached processes are
+recorded instead of started. The v0 API of the emojis plugin is covered
+too, its locations are in a temporary directory, or in $ALBERT_BENCH_HOME
+to keep caches from one run to the next.
+"""
+
+import os
+import tempfile
+
+detachedProcesses = []
+home = os.environ.get("ALBERT_BENCH_HOME") or tempfile.mkdtemp(prefix="albert-bench-")
+
+
+class QueryHandler:
+    pass
+
+
+class Item:
+    def __init__(self, id="", icon=None, text="", subtext="", completion="", actions=()):
+        self.id = id
+        self.icon = icon
+        self.text = text
+        self.subtext = subtext
+        self.completion = completion
+        self.actions = list(actions)
+
+
+class Action:
+    def __init__(self, id, text, callable):
+        self.id = id
+        self.text = text
+        self.callable = callable
+
+
+def runDetachedProcess(cmdln, workdir=""):
+    detachedProcesses.append(list(cmdln))
+
+
+def openUrl(url):
+    pass
+
+
+def setClipboardText(text):
+    pass
+
+
+def sendTrayNotification(title, msg, ms=10000):
+    pass
+
+
+# v0 API ---------------------------------------------------------------------
+
+
+def location(name):
+    path = os.path.join(home, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cacheLocation():
+    return location("cache")
+
+
+def configLocation():
+    return location("config")
+
+
+def dataLocation():
+    return location("data")
+
+
+class FuncAction:
+    def __init__(self, text, callable):
+        self.text = text
+        self.callable = callable
+
+
+class UrlAction:
+    def __init__(self, text, url):
+        self.text = text
+        self.url = url
+
+
+class ClipAction:
+    def __init__(self, text, clipboardText):
+        self.text = text
+        self.clipboardText = clipboardText
+
+
+def critical(msg):
+    print(msg)
@@ -0,0 +1,76 @@
+"""Bookmarks trigram index against a linear scan.
+
+Writes a synthetic bookmarks CSV, builds the plugin's BookmarkIndex and
+times the same searches through the index and through BookmarkQuery.matches
+over every bookmark.
+
+    python bench/bookmarks_index.py [--bookmarks N] [--repeat N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import timeit
+
+from harness import loadPlugin, percentile, writeBookmarksCsv
+
+SEARCHES = [
+    "p",
+    "py",
+    "pyt",
+    "python",
+    "rust kernel",
+    '"memory leak"',
+    "lwn.net",
+    "zzz",
+    "tag:rust",
+    "tag:rust tag:video",
+    "tag:talk name:perf",
+    "url:github py",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookmarks", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    bm = loadPlugin("bookmarks")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bookmarks.csv")
+        writeBookmarksCsv(path, args.bookmarks)
+
+        start = time.perf_counter()
+        bookmarks = bm.readBookmarks(path)
+        parsed = time.perf_counter()
+        index = bm.BookmarkIndex.build(bookmarks)
+        built = time.perf_counter()
+
+    print(f"{len(bookmarks)} bookmarks: parse {parsed - start:.2f}s, index {built - parsed:.2f}s")
+    print(f"{'search':<22}{'matches':>9}{'scan ms':>10}{'index ms':>10}{'speedup':>9}")
+
+    for search in SEARCHES:
+        query = bm.BookmarkQuery.parse(search)
+
+        def scan():
+            return [b for b in bookmarks if query.matches(b)]
+
+        def indexed():
+            return index.search(query)
+
+        assert scan() == indexed()
+        times = [
+            percentile(timeit.repeat(fn, number=1, repeat=args.repeat), 50) * 1000
+            for fn in (scan, indexed)
+        ]
+        print(
+            f"{search!r:<22}{len(indexed()):>9}{times[0]:>10.3f}{times[1]:>10.3f}"
+            f"{times[0] / times[1]:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
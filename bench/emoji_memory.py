@@ -0,0 +1,82 @@
+"""Memory held by the emoji index, compact store against plain objects.
+
+Builds the emojis plugin's EmojiIndex and the dicts, lists and tuples the
+plugin kept before it, from the same em data, and prints what each keeps
+allocated as measured by tracemalloc.
+
+    python bench/emoji_memory.py [--synthetic N]
+
+Without em installed, or with --synthetic, made up emojis are indexed.
+"""
+
+import argparse
+import gc
+import marshal
+import tracemalloc
+from collections import defaultdict
+
+from harness import emojiData, loadPlugin
+
+
+def previousLayout(emojis, plugin):
+    """What the plugin held per index before the compact store"""
+    label_to_emoji = {label: emoji for emoji, labels in emojis.items() for label in labels}
+
+    labels = sorted(label_to_emoji, key=str.lower)
+    keys = [label.lower() for label in labels]
+    bigrams = defaultdict(list)
+    for i, key in enumerate(keys):
+        for bigram in {key[j : j + 2] for j in range(len(key) - 1)}:
+            bigrams[bigram].append(i)
+
+    records = {emoji: plugin.emoji_record(emoji, labels) for emoji, labels in emojis.items()}
+    return emojis, label_to_emoji, labels, keys, dict(bigrams), records
+
+
+def measure(build, data):
+    """Bytes still allocated after build(data) and at most while building"""
+    gc.collect()
+    tracemalloc.start()
+    # fresh objects, so that what the layout keeps of them is counted
+    emojis = marshal.loads(data)
+    kept = build(emojis)
+    del emojis
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--synthetic", type=int, help="index N made up emojis")
+    args = parser.parse_args()
+
+    plugin = loadPlugin("emojis")
+    emojis = emojiData(args.synthetic)
+    data = marshal.dumps(emojis)
+    labels = sum(map(len, emojis.values()))
+    print(f"{len(emojis)} emojis, {labels} labels")
+
+    # the index as read back from the plugin's cache, without em's data
+    cached = marshal.dumps(plugin.EmojiIndex.build(emojis).dump())
+
+    layouts = {
+        "previous": lambda emojis: previousLayout(emojis, plugin),
+        "compact": plugin.EmojiIndex.build,
+        "compact, cached": lambda emojis: plugin.EmojiIndex.load(marshal.loads(cached)),
+    }
+
+    print(f"{'layout':<18}{'kept KiB':>10}{'peak KiB':>10}")
+    results = {}
+    for name, build in layouts.items():
+        current, peak = measure(build, data)
+        results[name] = current
+        print(f"{name:<18}{current / 1024:>10.0f}{peak / 1024:>10.0f}")
+
+    print(f"compact keeps {results['compact'] / results['previous']:.0%} of the previous")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Micro-benchmark: the shared fuzzy matcher against the old regex path.
+
+Scores every title for every token with plugin_common's fuzzyMatch and with
+the ``a[^b]*b`` patterns window-switcher used before, and prints the time
+per title.
+
+    python bench/fuzzy_matcher.py [--titles N] [--repeat N]
+"""
+
+import argparse
+import random
+import re
+import timeit
+
+from harness import loadPlugin
+
+WORDS = (
+    "github pull request review issue firefox mozilla private browsing youtube "
+    "watch docs python reference stack overflow question answer kitty vim "
+    "terminal slack channel general random meeting notes calendar inbox"
+).split()
+
+TOKENS = ["f", "fx", "gthb", "pllrqst", "stackovfl", "zzz"]
+
+
+def regexScore(entry, token, regexp):
+    """Score of a title as window-switcher computed it with a pattern"""
+    score = 0
+    for match in regexp.finditer(entry.description):
+        if match.start() == 0 and len(match.group(0)) == len(token):
+            score += 100
+        newscore = (
+            1.0 / (1 + match.start())
+            + (1.2 if match.start() in entry.wordStarts else 0.0)
+            + (2.3 * (len(token) - len(match.group(0)))) / len(match.group(0))
+        )
+        score = max(score, newscore)
+    return score
+
+
+def makeTitles(count, words, rng):
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ws = loadPlugin("window-switcher")
+    # importable once the plugin put the plugins directory on sys.path
+    from plugin_common.matching import fuzzyMatch
+    rng = random.Random(0)
+
+    corpora = {
+        "short titles": makeTitles(args.titles, 4, rng),
+        "browser titles": makeTitles(args.titles, 30, rng),
+        # worst case for the regex: many starts, no completion
+        "repeated chars": ["f" * 300 + " " + "x" * 50] * (args.titles // 10 or 1),
+    }
+
+    print(f"{'corpus':<16}{'token':<12}{'regex µs':>10}{'fuzzy µs':>10}{'speedup':>9}")
+    for name, titles in corpora.items():
+        entries = [ws.indexWindow(ws.Window("0x0", "0", "x.X", "h", t)) for t in titles]
+
+        for token in TOKENS:
+            pattern = re.compile(
+                re.escape(token[0])
+                + "".join(f"[^{re.escape(c)}]*{re.escape(c)}" for c in token[1:]),
+                flags=re.I,
+            )
+
+            def regex():
+                for e in entries:
+                    regexScore(e, token, pattern)
+
+            def fuzzy():
+                for e in entries:
+                    fuzzyMatch(e.folded, e.wordStarts, token)
+
+            perTitle = [
+                min(timeit.repeat(fn, number=1, repeat=args.repeat)) / len(entries) * 1e6
+                for fn in (regex, fuzzy)
+            ]
+            print(
+                f"{name:<16}{token:<12}{perTitle[0]:>10.2f}{perTitle[1]:>10.2f}"
+                f"{perTitle[0] / perTitle[1]:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Shared pieces of the benchmarks: plugin loading, queries, datasets, stats."""
+
+import csv
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+PLUGINS_DIR = BENCH_DIR.parent / "python/plugins"
+
+# the stub albert module lives next to this file
+sys.path.insert(0, str(BENCH_DIR))
+
+
+def loadPlugin(name):
+    """Import python/plugins/<name> as a fresh module"""
+    spec = importlib.util.spec_from_file_location(
+        name.replace("-", "_"), PLUGINS_DIR / name / "__init__.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Query:
+    """What handleQuery gets from Albert"""
+
+    def __init__(self, string):
+        self.string = string
+        self.isValid = True
+        self.isTriggered = True  # v0 API
+        self.items = []
+
+    def add(self, items):
+        self.items.extend(items if isinstance(items, list) else [items])
+
+    def disableSort(self):  # v0 API
+        pass
+
+
+def typed(text):
+    """Every prefix of text, as the query looks after each keystroke"""
+    return [text[:i] for i in range(1, len(text) + 1)]
+
+
+class PhaseTimer:
+    """Collects durations per phase and query.
+
+    Wrap callables with timed(), their durations add up until endQuery()
+    stores one sample per phase.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.pending = {}
+
+    def timed(self, phase, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+
+        return wrapper
+
+    def add(self, phase, seconds):
+        self.pending[phase] = self.pending.get(phase, 0.0) + seconds
+
+    def endQuery(self):
+        for phase, seconds in self.pending.items():
+            self.samples.setdefault(phase, []).append(seconds)
+        self.pending = {}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def printPercentiles(title, timer, phases, percentiles=(50, 95, 99)):
+    print(title)
+    header = "".join(f"{f'p{p} ms':>10}" for p in percentiles)
+    print(f"  {'phase':<10}{header}")
+    for phase in phases:
+        samples = timer.samples.get(phase, [])
+        row = "".join(f"{percentile(samples, p) * 1000:>10.3f}" for p in percentiles)
+        print(f"  {phase:<10}{row}")
+
+
+# synthetic windows ---------------------------------------------------------
+
+WINDOW_CLASSES = {
+    "Navigator.firefox": [
+        "{words} - GitHub — Mozilla Firefox",
+        "Pull Request #{n}: {words} by {user} · {user}/{project} — Mozilla Firefox",
+        "{words} - YouTube — Mozilla Firefox",
+        "{words} - Stack Overflow — Mozilla Firefox",
+    ],
+    "google-chrome.Google-chrome": ["{words} - Google Chrome", "Inbox ({n}) - Gmail"],
+    "kitty.kitty": ["{user}@host: ~/src/{project}", "vim {file}", "htop"],
+    "code.Code": ["{file} - {project} - Visual Studio Code"],
+    "slack.Slack": ["Slack | {words} | {project}"],
+    "org.gnome.Nautilus.Org.gnome.Nautilus": ["{project}", "Downloads"],
+    "emacs.Emacs": ["{file} - GNU Emacs at host"],
+    "libreoffice.libreoffice-writer": ["{words}.odt - LibreOffice Writer"],
+    "gimp-2.10.Gimp-2.10": ["[{file}] (imported)-1.0 (RGB color 8-bit gamma)"],
+}
+
+WORDS = (
+    "fix crash when loading config add support for custom key bindings refactor "
+    "parser release notes roadmap meeting agenda weekly sync design review "
+    "benchmark results performance regression python rust tutorial how to "
+    "window manager launcher plugin search index cache memory leak"
+).split()
+USERS = ["alice", "bob", "carol", "dave", "erin"]
+PROJECTS = ["albert-plugins", "dotfiles", "website", "kernel", "notebook"]
+FILES = ["main.py", "__init__.py", "README.md", "Makefile", "config.toml", "lib.rs"]
+
+
+def syntheticWindows(count, desktops=4, seed=0):
+    """wmctrl -l -x lines for count windows"""
+    rng = random.Random(seed)
+    lines = []
+    classes = list(WINDOW_CLASSES)
+
+    for i in range(count):
+        wm_class = rng.choice(classes)
+        title = rng.choice(WINDOW_CLASSES[wm_class]).format(
+            words=" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))),
+            n=rng.randint(1, 9999),
+            user=rng.choice(USERS),
+            project=rng.choice(PROJECTS),
+            file=rng.choice(FILES),
+        )
+        # a few windows are sticky, wmctrl lists them on desktop -1
+        desktop = -1 if rng.random() < 0.02 else rng.randrange(desktops)
+        lines.append("0x%08x %2d %s host %s" % (0x3A00000 + i, desktop, wm_class, title))
+
+    return lines
+
+
+def writeWmctrlData(directory, count, desktops=4, current=0, seed=0):
+    """Data for bench/bin/wmctrl, returns the environment to run it with"""
+    directory = Path(directory)
+    with open(directory / "desktops", "w") as f:
+        for d in range(desktops):
+            mark = "*" if d == current else "-"
+            f.write(f"{d}  {mark} DG: 1920x1080  VP: 0,0  WA: 0,0 1920x1080  {d + 1}\n")
+
+    with open(directory / "windows", "w") as f:
+        f.write("\n".join(syntheticWindows(count, desktops, seed)) + "\n")
+
+    return wmctrlEnvironment(directory)
+
+
+def wmctrlEnvironment(directory):
+    """The environment that has bench/bin/wmctrl print the data in directory"""
+    env = dict(os.environ)
+    env["FAKE_WMCTRL_DIR"] = str(directory)
+    env["PATH"] = f"{BENCH_DIR / 'bin'}{os.pathsep}{env.get('PATH', '')}"
+    return env
+
+
+# synthetic bookmarks --------------------------------------------------------
+
+HOSTS = [
+    "github.com",
+    "news.ycombinator.com",
+    "en.wikipedia.org",
+    "docs.python.org",
+    "blog.rust-lang.org",
+    "www.youtube.com",
+    "stackoverflow.com",
+    "lwn.net",
+]
+TAGS = (
+    "rust python linux kernel performance database design video talk paper "
+    "tutorial reference tools security networking music recipes"
+).split()
+
+
+def writeBookmarksCsv(path, count, seed=0):
+    """A bookmarks CSV in the layout the bookmarks plugin reads"""
+    rng = random.Random(seed)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "url", "tags", "desc"])
+
+        for i in range(count):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(2, 7))]
+            name = " ".join(words).capitalize()
+            url = "https://%s/%s/%d" % (rng.choice(HOSTS), "-".join(words[:3]), i)
+            tags = " ".join(rng.sample(TAGS, rng.randint(0, 3)))
+            writer.writerow([str(i), name, url, tags, ""])
+
+
+# emojis ---------------------------------------------------------------------
+
+
+def emojiData(synthetic=None, seed=0):
+    """em.parse_emojis(), or that many made up emojis if given or em is missing"""
+    if synthetic is None:
+        try:
+            import em
+
+            return em.parse_emojis()
+        except ImportError:
+            synthetic = 1800
+
+    rng = random.Random(seed)
+    emojis = {}
+    for i in range(synthetic):
+        name = "_".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        tags = rng.sample(WORDS, rng.randint(1, 8))
+        emojis[chr(0x1F300 + i)] = [name] + tags
+
+    return emojis
+
+
+def writeFakeEm(directory, emojis):
+    """An em package serving emojis and an em command, for when em is missing.
+
+    Returns the environment to run the emojis plugin with.
+    """
+    directory = Path(directory)
+    package = directory / "em"
+    package.mkdir(parents=True, exist_ok=True)
+    with open(package / "emojis.json", "w") as f:
+        json.dump(emojis, f)
+    with open(package / "__init__.py", "w") as f:
+        f.write(
+            "import json, os\n\n\n"
+            "def parse_emojis():\n"
+            "    with open(os.path.join(os.path.dirname(__file__), 'emojis.json')) as f:\n"
+            "        return json.load(f)\n"
+        )
+
+    command = directory / "bin" / "em"
+    command.parent.mkdir(exist_ok=True)
+    command.write_text("#!/bin/sh\nexit 0\n")
+    command.chmod(0o755)
+
+    return fakeEmEnvironment(directory)
+
+
+def fakeEmEnvironment(directory):
+    """The environment that finds the em written by writeFakeEm to directory"""
+    directory = Path(directory)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(directory), env.get("PYTHONPATH")]))
+    env["PATH"] = f"{directory / 'bin'}{os.pathsep}{env.get('PATH', '')}"
+    return env
+
+
+# synthetic Cuis images ------------------------------------------------------
+
+COURSES = ["tp1", "tp2", "tp3", "tp4", "tp5", "tp6", "parcial", "recuperatorio", "final"]
+STUDENTS = (
+    "alice bob carol dave erin frank grace heidi ivan judy mallory niaj olivia "
+    "peggy rupert sybil trent victor walter"
+).split()
+IMAGE_NAMES = ["Cuis", "Cuis-Smalltalk", "Entrega", "Solucion", "Final", "Backup"]
+
+
+def writeCuisTree(root, count, seed=0):
+    """count empty .image files in year/course/student directories under root"""
+    rng = random.Random(seed)
+    root = Path(root)
+
+    for i in range(count):
+        directory = root / str(rng.randint(2016, 2024)) / rng.choice(COURSES)
+        directory /= "%s-%s" % (rng.choice(STUDENTS), rng.choice(STUDENTS))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = "%s-%s-%d.image" % (rng.choice(IMAGE_NAMES), rng.choice(WORDS), i)
+        (directory / name).touch()
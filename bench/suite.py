@@ -0,0 +1,374 @@
+"""Latency of every plugin on large synthetic data, as JSON for tracking.
+
+Generates 5k windows behind the fake wmctrl, a 200k bookmarks CSV, the em
+emoji set (made up emojis without em) and a 50k images Cuis tree, then runs
+each plugin in a fresh process: it is imported and initialized, waited for
+until its data is loaded, and fed typed queries one keystroke at a time
+through handleQuery. Plugins with caches on disk run twice, cold without
+them and warm with the ones the cold run left.
+
+Reported per run: start (import and initialize), ready (until the data is
+loaded), the first query, p50/p99 of the keystrokes after it and the peak
+RSS of the process. With --baseline the changes against an earlier --json
+file are printed too.
+
+    python bench/suite.py [--plugins NAME ...] [--json results.json]
+                          [--baseline previous.json] [--data DIR]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from harness import (
+    BENCH_DIR,
+    Query,
+    emojiData,
+    fakeEmEnvironment,
+    loadPlugin,
+    percentile,
+    typed,
+    wmctrlEnvironment,
+    writeBookmarksCsv,
+    writeCuisTree,
+    writeFakeEm,
+    writeWmctrlData,
+)
+
+PLUGINS = ["window-switcher", "bookmarks", "emojis", "cuis"]
+# these keep caches on disk, a second run shows the warm start
+CACHED = {"bookmarks", "emojis"}
+
+SEARCHES = {
+    "window-switcher": [
+        "firefox",
+        "github pull",
+        "*slack",
+        "* vim main",
+        "code init",
+        "kitty src",
+        "youtube",
+        "release notes",
+    ],
+    "bookmarks": [
+        "python",
+        "rust kernel",
+        "tag:video talk",
+        "lwn.net",
+        "memory leak",
+        "url:github py",
+        "how to",
+        "zzz",
+    ],
+    "emojis": [
+        "smile",
+        "heart",
+        "thumbs up",
+        "fire",
+        "cat face",
+        "rocket",
+        "fix crash",
+        "memory",
+    ],
+    "cuis": [
+        "tp3",
+        "alice final",
+        "2023/parcial",
+        "smalltalk",
+        "entrega",
+        "bob-dave",
+        "backup leak",
+        "zzz",
+    ],
+}
+
+METRICS = ["startMs", "readyMs", "firstMs", "p50Ms", "p99Ms", "peakRssMiB"]
+READY_TIMEOUT = 600.0
+# smaller baseline values are left out of the comparison
+MIN_COMPARED = 0.05
+
+
+def keystrokes(plugin):
+    """The queries sent while typing the plugin's searches, in order"""
+    return [query for search in SEARCHES[plugin] for query in typed(search)]
+
+
+# datasets -------------------------------------------------------------------
+
+
+def prepare(plugin, data, args):
+    """Writes the plugin's dataset to data unless there, returns its environment"""
+    data.mkdir(parents=True, exist_ok=True)
+
+    if plugin == "window-switcher":
+        if not (data / "windows").exists():
+            writeWmctrlData(data, args.windows)
+        env = wmctrlEnvironment(data)
+        env.pop("DISPLAY", None)  # always exercise the wmctrl path
+
+    elif plugin == "bookmarks":
+        if not (data / "bookmarks.csv").exists():
+            writeBookmarksCsv(data / "bookmarks.csv", args.bookmarks)
+        env = dict(os.environ)
+
+    elif plugin == "emojis":
+        if args.emojis is None and hasEm():
+            env = dict(os.environ)
+        else:
+            if not (data / "em").exists():
+                writeFakeEm(data, emojiData(args.emojis))
+            env = fakeEmEnvironment(data)
+
+    elif plugin == "cuis":
+        if not (data / "images").exists():
+            # written aside first, an interrupted run leaves no partial tree
+            writeCuisTree(data / "images.tmp", args.cuis_images)
+            (data / "images.tmp").rename(data / "images")
+        env = dict(os.environ)
+
+    env["ALBERT_BENCH_HOME"] = str(data / "home")
+    env["XDG_DATA_HOME"] = str(data / "home")
+    return env
+
+
+def hasEm():
+    try:
+        import em  # noqa: F401
+    except ImportError:
+        return False
+    return shutil.which("em") is not None
+
+
+def clearCaches(data):
+    """Removes what earlier runs left: Albert's locations and sidecar indexes"""
+    shutil.rmtree(data / "home", ignore_errors=True)
+    for sidecar in data.glob(".*.sqlite*"):
+        sidecar.unlink()
+
+
+# one run, in a process of its own --------------------------------------------
+
+
+def setUp(plugin, module, data):
+    """(handle, ready, size, close) for the loaded plugin module.
+
+    handle(string) runs a query and returns the number of items, ready()
+    tells whether the data is loaded and size() how much there is.
+    """
+    if plugin == "emojis":  # v0 API, module level functions
+        module.initialize()
+        return (
+            lambda string: len(module.handleQuery(Query(string))),
+            lambda: True,  # the index is loaded on the first query
+            lambda: len(module.emoji_index),
+            module.finalize,
+        )
+
+    if plugin == "window-switcher":
+        module.windowBackend = "wmctrl"
+    elif plugin == "bookmarks":
+        csvPath = str(data / "bookmarks.csv")
+        module.BOOKMARKS_SOURCES = [csvPath]
+    elif plugin == "cuis":
+        module.CUIS_IMAGES_DIRS = [str(data / "images")]
+
+    instance = module.Plugin()
+    instance.initialize()
+
+    def handle(string):
+        query = Query(string)
+        instance.handleQuery(query)
+        return len(query.items)
+
+    if plugin == "window-switcher":
+        ready = lambda: True
+        size = lambda: len(instance.getWindows())
+    elif plugin == "bookmarks":
+        stores = lambda: instance.sources.shards.items()
+        ready = lambda: all(
+            not store.checking and store.stamp == module.fileStamp(path)
+            for path, store in stores()
+        )
+        size = lambda: sum(1 for _ in open(csvPath)) - 1
+    else:
+        ready = lambda: instance.catalog.generation > 0
+        size = lambda: len(instance.catalog.images.paths)
+
+    return handle, ready, size, instance.finalize
+
+
+def peakRssMiB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def runOne(plugin, data):
+    """The measurements of one run of plugin on the dataset in data"""
+    baseline = peakRssMiB()
+    start = time.perf_counter()
+    module = loadPlugin(plugin)
+    handle, ready, size, close = setUp(plugin, module, data)
+    started = time.perf_counter()
+
+    while not ready():
+        if time.perf_counter() - started > READY_TIMEOUT:
+            raise TimeoutError(f"{plugin} did not load its data")
+        time.sleep(0.005)
+    loaded = time.perf_counter()
+
+    samples, items = [], []
+    for string in keystrokes(plugin):
+        before = time.perf_counter()
+        items.append(handle(string))
+        samples.append(time.perf_counter() - before)
+
+    peak = peakRssMiB()
+    result = {
+        "size": size(),
+        "startMs": (started - start) * 1000,
+        "readyMs": (loaded - started) * 1000,
+        "firstMs": samples[0] * 1000,
+        "p50Ms": percentile(samples[1:], 50) * 1000,
+        "p99Ms": percentile(samples[1:], 99) * 1000,
+        "keystrokes": len(samples),
+        "items": sum(items),
+        "peakRssMiB": peak,
+        "baseRssMiB": baseline,
+    }
+    close()
+    return result
+
+
+def runChild(plugin, data, env, cache):
+    """runOne in a fresh interpreter, so that imports and memory start cold"""
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as out:
+        subprocess.run(
+            [sys.executable, __file__, "--child", plugin, "--data", str(data), "--out", out.name],
+            env=env,
+            check=True,
+        )
+        result = json.load(out)
+
+    return {"plugin": plugin, "cache": cache, **result}
+
+
+# reporting ------------------------------------------------------------------
+
+
+def printResults(results, file=sys.stdout):
+    print(
+        f"{'plugin':<17}{'cache':<7}{'size':>8}{'start ms':>10}{'ready ms':>10}"
+        f"{'first ms':>10}{'p50 ms':>9}{'p99 ms':>9}{'peak MiB':>10}",
+        file=file,
+    )
+    for r in results:
+        print(
+            f"{r['plugin']:<17}{r['cache']:<7}{r['size']:>8}{r['startMs']:>10.1f}"
+            f"{r['readyMs']:>10.1f}{r['firstMs']:>10.2f}{r['p50Ms']:>9.3f}"
+            f"{r['p99Ms']:>9.3f}{r['peakRssMiB']:>10.1f}",
+            file=file,
+        )
+
+
+def printChanges(results, baseline, file=sys.stdout):
+    """Per metric, how much results differ from the baseline's, in percent"""
+    previous = {(r["plugin"], r["cache"]): r for r in baseline["results"]}
+    print(f"\nchange against {baseline['meta'].get('commit') or 'baseline'}", file=file)
+    print(f"{'plugin':<17}{'cache':<7}" + "".join(f"{m:>12}" for m in METRICS), file=file)
+
+    for r in results:
+        old = previous.get((r["plugin"], r["cache"]))
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS:
+            # a percentage of next to nothing is just noise
+            if old.get(metric, 0) >= MIN_COMPARED:
+                changes.append(f"{(r[metric] / old[metric] - 1) * 100:>+11.0f}%")
+            else:
+                changes.append(f"{'-':>12}")
+        print(f"{r['plugin']:<17}{r['cache']:<7}" + "".join(changes), file=file)
+
+
+def gitCommit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plugins", nargs="+", choices=PLUGINS, default=PLUGINS)
+    parser.add_argument("--windows", type=int, default=5000)
+    parser.add_argument("--bookmarks", type=int, default=200_000)
+    parser.add_argument("--emojis", type=int, help="index N made up emojis, even with em")
+    parser.add_argument("--cuis-images", type=int, default=50_000)
+    parser.add_argument("--data", type=Path, help="keep the datasets here and reuse them")
+    parser.add_argument("--json", help="write the results to this file, - for stdout")
+    parser.add_argument("--baseline", help="an earlier --json file to compare with")
+    parser.add_argument("--child", choices=PLUGINS, help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = runOne(args.child, args.data)
+        with open(args.out, "w") as f:
+            json.dump(result, f)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="albert-suite-") as scratch:
+        root = args.data or Path(scratch)
+        results = []
+
+        for plugin in args.plugins:
+            data = root / plugin
+            print(f"preparing {plugin}...", file=sys.stderr)
+            env = prepare(plugin, data, args)
+
+            clearCaches(data)
+            for cache in ["cold", "warm"] if plugin in CACHED else ["cold"]:
+                results.append(runChild(plugin, data, env, cache))
+
+    # keep stdout for the JSON if it goes there
+    out = sys.stderr if args.json == "-" else sys.stdout
+    printResults(results, out)
+
+    report = {
+        "meta": {
+            "commit": gitCommit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            printChanges(results, json.load(f), out)
+
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Window-switcher latency against a fake wmctrl, no Albert or X session needed.
+
+Replays typed queries through Plugin.handleQuery for several window counts,
+with and without fuzzy matching, and prints p50/p95/p99 per phase: fetch
+(wmctrl calls), filter (indexing and scoring), items (Item construction).
+
+    python bench/window_switcher.py [--windows 10 100 1000 5000] [--rounds N]
+"""
+
+import argparse
+import os
+import tempfile
+
+from harness import PhaseTimer, Query, loadPlugin, printPercentiles, typed, writeWmctrlData
+
+QUERIES = (
+    typed("firefox")
+    + typed("github pull")
+    + typed("*slack")
+    + typed("* vim main")
+    + typed("code init")
+)
+
+
+def run(ws, windows, fuzzy, rounds, directory):
+    os.environ.update(writeWmctrlData(directory, windows))
+    ws.matchFuzzy = fuzzy
+
+    plugin = ws.Plugin()
+    plugin.initialize()
+
+    timer = PhaseTimer()
+    plugin.getWindows = timer.timed("fetch", plugin.getWindows)
+    plugin.getCurrentWorkspace = timer.timed("fetch", plugin.getCurrentWorkspace)
+    plugin.getIndex = timer.timed("filter", plugin.getIndex)
+    plugin.filterWindows = timer.timed("filter", plugin.filterWindows)
+    plugin.createItems = timer.timed("items", plugin.createItems)
+    handleQuery = timer.timed("total", plugin.handleQuery)
+
+    for _ in range(rounds):
+        for string in QUERIES:
+            handleQuery(Query(string))
+            timer.endQuery()
+
+    plugin.finalize()
+    return timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--windows", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # no X connection: always exercise the wmctrl path
+    os.environ.pop("DISPLAY", None)
+    ws = loadPlugin("window-switcher")
+    ws.windowBackend = "wmctrl"
+
+    with tempfile.TemporaryDirectory() as directory:
+        for windows in args.windows:
+            for fuzzy in (False, True):
+                timer = run(ws, windows, fuzzy, args.rounds, directory)
+                printPercentiles(
+                    f"{windows} windows, {'fuzzy' if fuzzy else 'substring'} "
+                    f"({len(QUERIES) * args.rounds} queries)",
+                    timer,
+                    ["fetch", "filter", "items", "total"],
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import os
+import abc
+import array
 import csv
 import dataclasses
+import heapq
 import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
 from albert import (
     QueryHandler,
     Action,
@@ -13,6 +22,13 @@ from albert import (
     sendTrayNotification,
 )
 
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from plugin_common import Cancelled, ResultCache, cancellable, checkValid
+from plugin_common.instrument import QueryStats
+from plugin_common.matching import Matcher, highlight, matchKey
+
 md_iid = "0.5"
 md_version = "0.1"
 md_name = "Bookmarks"
@@ -22,28 +38,788 @@ md_maintainers = "@jonathannerat"
 md_license = "MIT"
 
 BOOKMARKS_CSV = os.environ["HOME"] + "/notebook/bookmarks.csv"
+# CSV files, or directories whose *.csv files are all loaded, searched as one
+# in this order; each file is reloaded on its own when it changes
+BOOKMARKS_SOURCES = [BOOKMARKS_CSV]
+# threads parsing and indexing changed files
+LOAD_THREADS = min(4, os.cpu_count() or 1)
 ICON = ["/usr/share/icons/Papirus-Dark/16x16/actions/bookmarks.svg"]
+# seconds between checks whether BOOKMARKS_SOURCES changed
+RELOAD_CHECK_INTERVAL = 1.0
+MAX_RESULTS = 50
+# keep an SQLite FTS5 index next to every bookmarks file, shared between
+# restarts and Albert instances, instead of parsing the CSV on startup
+SIDECAR_INDEX = True
+# time queries and count file reads, the query "stats" shows them
+INSTRUMENT = False
+
+# match ranks, lower is better
+RANK_NAME_PREFIX, RANK_NAME, RANK_TAGS, RANK_URL = range(4)
+
+# query terms: plain words, field:value, values quoted to include spaces
+QUERY_TERM = re.compile(r'(?:(\w+):)?(?:"([^"\n]*)"?|(\S*))')
+QUERY_FIELDS = {"name": "names", "url": "urls", "tag": "tags", "tags": "tags"}
+TAG_SEPARATOR = re.compile(r"[\s,]+")
 
 
-@dataclasses.dataclass()
+@dataclasses.dataclass(slots=True)
 class Bookmark:
     id: str
     name: str
     url: str
     tags: str
     desc: str
+    # "name\nurl\ntags" as fieldKeys, searches never contain a newline so a
+    # substring of key is always a substring of a single field
+    key: str = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.key = "\n".join((fieldKey(self.name), fieldKey(self.url), fieldKey(self.tags)))
+
+    def rank(self, search: str):
+        """How well a matching bookmark matches search, see RANK_*"""
+        key = self.key
+        if key.startswith(search):
+            return RANK_NAME_PREFIX
+
+        if key.find(search) < key.find("\n"):
+            return RANK_NAME
+
+        if key.find(search, key.rfind("\n")) >= 0:
+            return RANK_TAGS
+
+        return RANK_URL
+
+
+@dataclasses.dataclass(frozen=True)
+class BookmarkQuery:
+    """A parsed search, a bookmark must match every term.
+
+    Plain words match anywhere in the name, url or tags, name: and url:
+    terms only in that field and tag: terms must equal one of the tags.
+    """
+
+    words: tuple[str, ...] = ()
+    names: tuple[str, ...] = ()
+    urls: tuple[str, ...] = ()
+    tags: tuple[str, ...] = ()
+
+    @classmethod
+    def parse(cls, search: str):
+        terms = {"words": [], "names": [], "urls": [], "tags": []}
+
+        for term in QUERY_TERM.finditer(search.lower()):
+            field, quoted, value = term.groups()
+            value = quoted if quoted is not None else value
+            if field in QUERY_FIELDS:
+                field = QUERY_FIELDS[field]
+            elif field is not None:  # not an operator, like https://...
+                field, value = "words", f"{field}:{value}"
+            else:
+                field = "words"
+
+            if value:  # a field still being typed matches everything
+                terms[field].append(value)
+
+        return cls(**{field: tuple(values) for field, values in terms.items()})
+
+    def substrings(self):
+        return self.words + self.names + self.urls
+
+    @property
+    def plain(self):
+        """The search if it is a single plain word, the common case"""
+        if len(self.words) == 1 and not (self.names or self.urls or self.tags):
+            return self.words[0]
+
+    def matches(self, bm: Bookmark):
+        key = bm.key
+        for word in self.words:
+            if word not in key:
+                return False
+
+        if self.names or self.urls:
+            nameEnd = key.find("\n")
+            urlEnd = key.find("\n", nameEnd + 1)
+            for text in self.names:
+                if key.find(text, 0, nameEnd) < 0:
+                    return False
+            for text in self.urls:
+                if key.find(text, nameEnd + 1, urlEnd) < 0:
+                    return False
+
+        return not self.tags or splitTags(bm.tags.lower()).issuperset(self.tags)
+
+    def rank(self, bm: Bookmark):
+        """The worst rank of the words and names, see RANK_*"""
+        rank = RANK_NAME_PREFIX
+        for word in self.words:
+            rank = max(rank, bm.rank(word))
+        for text in self.names:
+            if not bm.key.startswith(text):
+                rank = max(rank, RANK_NAME)
+        return rank
+
+    def __bool__(self):
+        return bool(self.substrings() or self.tags)
+
+
+class BookmarkIndex:
+    """Trigram and tag index over the lowercase name, url and tags of bookmarks.
+
+    Every trigram and every tag maps to the positions of the bookmarks
+    containing it, a query intersects the postings of its terms and checks
+    the remaining candidates with BookmarkQuery.matches. Two character
+    terms use the union of the trigrams that contain them, computed on
+    first use; one character terms don't narrow anything, and while the
+    index is still being built every bookmark is checked.
+    """
+
+    def __init__(self, bookmarks: list[Bookmark], trigrams=None, tags=None):
+        self.bookmarks = bookmarks
+        self.trigrams = trigrams
+        self.tags = tags
+        self.bigrams = {}
+
+    @classmethod
+    def build(cls, bookmarks: list[Bookmark]):
+        postings = defaultdict(list)
+        tagPostings = defaultdict(list)
+
+        # trigrams spanning two fields contain a newline and never match
+        for i, bm in enumerate(bookmarks):
+            key = bm.key
+            for gram in {key[j : j + 3] for j in range(len(key) - 2)}:
+                postings[gram].append(i)
+            for tag in splitTags(bm.tags.lower()):
+                tagPostings[tag].append(i)
+
+        trigrams = {gram: array.array("I", ids) for gram, ids in postings.items()}
+        tags = {tag: array.array("I", ids) for tag, ids in tagPostings.items()}
+        return cls(bookmarks, trigrams, tags)
+
+    def search(self, query: BookmarkQuery) -> list[Bookmark]:
+        """Bookmarks matching query, in file order"""
+        return [self.bookmarks[i] for i in self.positions(query)]
+
+    def best(self, query: BookmarkQuery, limit: int, albertQuery=None) -> list[Bookmark]:
+        """The limit best matches for query, ties in file order"""
+        bookmarks = self.bookmarks
+        search = query.plain
+        # bounded max-heap of (-rank, -position), heap[0] is the worst kept
+        heap = []
+
+        for i in cancellable(albertQuery, self.positions(query, albertQuery)):
+            rank = bookmarks[i].rank(search) if search else query.rank(bookmarks[i])
+            if len(heap) < limit:
+                heapq.heappush(heap, (-rank, -i))
+            elif rank < -heap[0][0]:  # later positions lose ties
+                heapq.heapreplace(heap, (-rank, -i))
+            elif heap[0][0] == -RANK_NAME_PREFIX:
+                break  # nothing can beat a full heap of best ranked matches
+
+        return [bookmarks[-i] for _, i in sorted(heap, reverse=True)]
+
+    def positions(self, query: BookmarkQuery, albertQuery=None):
+        """Positions of the bookmarks matching query, ascending"""
+        bookmarks = self.bookmarks
+        if not query:
+            return range(len(bookmarks))
+
+        candidates = self.candidates(query)
+        search = query.plain
+        if candidates is None:
+            scanned = enumerate(cancellable(albertQuery, bookmarks))
+            if search:
+                return [i for i, bm in scanned if search in bm.key]
+            return [i for i, bm in scanned if query.matches(bm)]
+
+        if search and len(search) <= 3 or len(query.tags) == 1 and not query.substrings():
+            # the posting of a single tag or gram is exactly the set of matches
+            return candidates
+
+        candidates = cancellable(albertQuery, candidates)
+        if search:
+            return [i for i in candidates if search in bookmarks[i].key]
+
+        return [i for i in candidates if query.matches(bookmarks[i])]
+
+    def candidates(self, query: BookmarkQuery):
+        """Sorted positions that may match query, None if every bookmark may"""
+        if self.trigrams is None:
+            return None
+
+        postings = [self.tags.get(tag, ()) for tag in query.tags]
+        for text in query.substrings():
+            posting = self.substringCandidates(text)
+            if posting is not None:
+                postings.append(posting)
+
+        return intersectRarest(postings)
+
+    def substringCandidates(self, search: str):
+        """Sorted positions that may contain search, None if every bookmark may"""
+        if len(search) < 2:
+            return None
+
+        if len(search) == 2:
+            return self.bigramPostings(search)
+
+        postings = []
+        for gram in {search[j : j + 3] for j in range(len(search) - 2)}:
+            posting = self.trigrams.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        return intersectRarest(postings)
+
+    def bigramPostings(self, bigram: str):
+        posting = self.bigrams.get(bigram)
+        if posting is None:
+            ids = set()
+            for gram, grams in self.trigrams.items():
+                if gram.startswith(bigram) or gram.endswith(bigram):
+                    ids.update(grams)
+
+            posting = self.bigrams[bigram] = array.array("I", sorted(ids))
+
+        return posting
+
+
+class Reloader(abc.ABC):
+    """Runs reload in the background, at most every RELOAD_CHECK_INTERVAL.
+
+    Only one reload runs at a time, it must clear checking when done. They
+    run on executor if given, else on a thread of their own. A reload that
+    changes what queries see bumps generation, after the change.
+    """
+
+    def __init__(self, executor: Executor = None):
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.checking = False
+        self.checked = float("-inf")
+        self.generation = 0
+
+    def refresh(self):
+        now = time.monotonic()
+
+        with self.lock:
+            if self.checking or now - self.checked < RELOAD_CHECK_INTERVAL:
+                return
+            self.checking = True
+            self.checked = now
+
+        if self.executor is not None:
+            self.executor.submit(self.reload)
+        else:
+            threading.Thread(target=self.reload, daemon=True).start()
+
+    @abc.abstractmethod
+    def reload(self):
+        """Load what changed, then clear checking"""
+
+
+class BookmarkStore(Reloader):
+    """Bookmarks parsed once and kept in memory.
+
+    Queries only read the current index. At most every RELOAD_CHECK_INTERVAL
+    a background thread compares the file's mtime, size and inode with the
+    loaded version and, if they changed, parses it and swaps the new
+    bookmarks in, followed by their trigram index once it is built.
+    """
+
+    def __init__(self, path: str, executor: Executor = None, stats: QueryStats = None):
+        super().__init__(executor)
+        self.path = path
+        self.stats = stats
+        self.index = BookmarkIndex([])
+        self.stamp = None
+
+    def best(self, query: BookmarkQuery, limit: int, albertQuery=None) -> list[Bookmark]:
+        self.refresh()
+        return self.index.best(query, limit, albertQuery)
+
+    def reload(self):
+        try:
+            stamp = fileStamp(self.path)
+            if stamp != self.stamp:
+                bookmarks = self.read(stamp)
+                # searchable right away, indexing a large file takes a while
+                self.index = BookmarkIndex(bookmarks)
+                self.generation += 1
+                self.index = BookmarkIndex.build(bookmarks)
+                self.stamp = stamp
+        except (csv.Error, ValueError):  # e.g. not UTF-8, skip until it changes
+            self.stamp = stamp
+        except OSError:  # keep what we have, retry on next check
+            pass
+        finally:
+            self.checking = False
+
+    def close(self):
+        """Release what the store holds open, it is not searched anymore"""
+
+    def read(self, stamp) -> list[Bookmark]:
+        """The bookmarks in the file, none if it is gone"""
+        if not stamp:
+            return []
+        if self.stats is not None:
+            self.stats.fileRead(self.path)
+        return readBookmarks(self.path)
+
+
+class BookmarkDatabase(BookmarkStore):
+    """Bookmarks mirrored into an SQLite database next to the CSV.
+
+    Terms of three or more characters go through an FTS5 trigram index and
+    tags through a tag table, ranking and limiting happen in SQL, so nothing
+    is parsed on startup once the database is synced. Until then, on its
+    first sync, queries scan the parsed bookmarks in memory.
+    When the CSV changes, rows are upserted or deleted by their id column,
+    only where they differ from the stored ones; rows that just moved get
+    their new position and nothing else. Raises sqlite3.Error if
+    the database can't be opened or sqlite lacks the trigram tokenizer.
+    """
+
+    # rows scanned in file order before a rank falls back to its full query
+    PROBE_ROWS = 5000
+    # sqlite steps between checks whether the query is still wanted
+    PROGRESS_STEPS = 10000
+    SCHEMA_VERSION = 4
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS bookmarks (
+            rowid INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            tags TEXT NOT NULL,
+            desc TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            url_key TEXT NOT NULL,
+            tags_key TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS bookmarks_position ON bookmarks (position);
+        CREATE INDEX IF NOT EXISTS bookmarks_name_key ON bookmarks (name_key);
+        CREATE TABLE IF NOT EXISTS bookmark_tags (
+            tag TEXT NOT NULL,
+            bookmark INTEGER NOT NULL,
+            PRIMARY KEY (tag, bookmark)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS bookmark_tags_bookmark ON bookmark_tags (bookmark);
+        CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts USING fts5(
+            name_key, url_key, tags_key,
+            content='bookmarks', content_rowid='rowid', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS bookmarks_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (rowid, name_key, url_key, tags_key)
+            VALUES (new.rowid, new.name_key, new.url_key, new.tags_key);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bookmarks_delete AFTER DELETE ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts
+                (bookmarks_fts, rowid, name_key, url_key, tags_key)
+            VALUES ('delete', old.rowid, old.name_key, old.url_key, old.tags_key);
+            DELETE FROM bookmark_tags WHERE bookmark = old.rowid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS bookmarks_update
+        AFTER UPDATE OF name_key, url_key, tags_key ON bookmarks
+        WHEN old.name_key IS NOT new.name_key OR old.url_key IS NOT new.url_key
+            OR old.tags_key IS NOT new.tags_key
+        BEGIN
+            INSERT INTO bookmarks_fts
+                (bookmarks_fts, rowid, name_key, url_key, tags_key)
+            VALUES ('delete', old.rowid, old.name_key, old.url_key, old.tags_key);
+            INSERT INTO bookmarks_fts (rowid, name_key, url_key, tags_key)
+            VALUES (new.rowid, new.name_key, new.url_key, new.tags_key);
+        END;
+    """
+
+    def __init__(self, path: str, executor: Executor = None, stats: QueryStats = None):
+        super().__init__(path, executor, stats)
+        directory, filename = os.path.split(path)
+        self.dbPath = os.path.join(directory, f".{filename}.sqlite")
+
+        # one connection for queries, guarded by queryLock; syncs open their own
+        self.queryLock = threading.Lock()
+        self.db = self.connect()
+        self.closed = False
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            with self.db:
+                self.db.executescript(
+                    "DROP TABLE IF EXISTS bookmarks_fts; DROP TABLE IF EXISTS bookmarks;"
+                    "DROP TABLE IF EXISTS bookmark_tags; DROP TABLE IF EXISTS meta;"
+                    + self.SCHEMA
+                )
+                self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        self.stamp = self.storedStamp(self.db)
+
+    def connect(self):
+        db = sqlite3.connect(self.dbPath, timeout=10, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL")
+        return db
+
+    def best(self, query: BookmarkQuery, limit: int, albertQuery=None) -> list[Bookmark]:
+        if self.stamp is None:  # not synced yet, the bookmarks are in memory
+            return super().best(query, limit, albertQuery)
 
-    def matches(self, search: str):
-        if search in self.name.lower():
-            return True
+        self.refresh()
 
-        if search in self.url.lower():
-            return True
+        params = {}
 
-        if search in self.tags.lower():
-            return True
+        def param(value):
+            params[f"p{len(params)}"] = value
+            return f":p{len(params) - 1}"
 
-        return False
+        filters, phrases, ranks = [], [], []
+        # name prefix matches of every ranked term, the best possible rank
+        prefixes = []
+
+        terms = [(text, None) for text in query.words]
+        terms += [(text, "name_key") for text in query.names]
+        for text, column in terms:
+            search, upper = param(text), param(text + "\U0010ffff")
+            prefix = f"(name_key >= {search} AND name_key < {upper})"
+            inName = f"instr(name_key, {search})"
+            prefixes.append(prefix)
+
+            if column:
+                filters.append(inName)
+                ranks.append(f"CASE WHEN {prefix} THEN 0 ELSE {RANK_NAME} END")
+            else:
+                inTags = f"instr(tags_key, {search})"
+                filters.append(f"({inName} OR {inTags} OR instr(url_key, {search}))")
+                ranks.append(
+                    f"CASE WHEN {prefix} THEN 0 WHEN {inName} THEN {RANK_NAME}"
+                    f" WHEN {inTags} THEN {RANK_TAGS} ELSE {RANK_URL} END"
+                )
+            phrases.append(ftsPhrase(text, column))
+
+        for text in query.urls:
+            filters.append(f"instr(url_key, {param(text)})")
+            phrases.append(ftsPhrase(text, "url_key"))
+
+        tags = [param(tag) for tag in query.tags]
+        tagged = [
+            "EXISTS (SELECT 1 FROM bookmark_tags AS t"
+            f" WHERE t.tag = {tag} AND t.bookmark = bookmarks.rowid)"
+            for tag in tags
+        ]
+
+        # the FTS index can't narrow terms shorter than a trigram
+        phrases = [phrase for phrase in phrases if phrase]
+        if phrases:
+            phrases = [
+                "bookmarks.rowid IN (SELECT rowid FROM bookmarks_fts"
+                f" WHERE bookmarks_fts MATCH {param(' AND '.join(phrases))})"
+            ]
+
+        source, order = "bookmarks", "bookmarks.position"
+        if tags:
+            # walk the postings of the first tag rather than every row
+            source = (
+                "bookmark_tags AS tagged JOIN bookmarks"
+                f" ON tagged.tag = {tags[0]} AND bookmarks.rowid = tagged.bookmark"
+            )
+        if ranks:
+            rank = ("max(%s)" if len(ranks) > 1 else "%s") % ", ".join(ranks)
+            order = f"{rank}, {order}"
+
+        params["limit"] = limit
+        select = "SELECT id, name, url, tags, desc FROM"
+
+        with self.queryLock:
+            if self.closed:  # the file was dropped while the query ran
+                return []
+            if albertQuery is not None:
+                # a nonzero return interrupts the running statement
+                self.db.set_progress_handler(
+                    lambda: not albertQuery.isValid, self.PROGRESS_STEPS
+                )
+
+            try:
+                # a page of best ranked matches among the first rows needs
+                # neither the indexes nor sorting every match
+                rows = self.db.execute(
+                    f"{select} bookmarks INDEXED BY bookmarks_position"
+                    f" WHERE position < {self.PROBE_ROWS}"
+                    f" AND {' AND '.join(prefixes + filters + tagged) or 1}"
+                    " ORDER BY position LIMIT :limit",
+                    params,
+                ).fetchall()
+
+                if len(rows) < limit:
+                    rows = self.db.execute(
+                        f"{select} {source}"
+                        f" WHERE {' AND '.join(phrases + filters + tagged[1:]) or 1}"
+                        f" ORDER BY {order} LIMIT :limit",
+                        params,
+                    ).fetchall()
+            except sqlite3.OperationalError:
+                checkValid(albertQuery)
+                raise
+            finally:
+                self.db.set_progress_handler(None, 0)
+
+        return [Bookmark(*row) for row in rows]
+
+    def reload(self):
+        try:
+            stamp = fileStamp(self.path)
+            if stamp != self.stamp:
+                bookmarks = self.read(stamp)
+                if self.stamp is None:
+                    # searchable right away, a first sync takes a while
+                    self.index = BookmarkIndex(bookmarks)
+                    self.generation += 1
+                self.sync(stamp, bookmarks)
+                self.stamp = stamp
+                self.index = BookmarkIndex([])
+                self.generation += 1
+        except (csv.Error, ValueError):  # e.g. not UTF-8, skip until it changes
+            self.stamp = stamp
+        except (OSError, sqlite3.Error):  # retry on next check
+            pass
+        finally:
+            self.checking = False
+
+    def sync(self, stamp, bookmarks: list[Bookmark]):
+        db = self.connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            # another Albert instance may have synced while we waited
+            if self.storedStamp(db) == stamp:
+                db.rollback()
+                return
+
+            stored = {
+                row[0]: (row[1], row[2:])
+                for row in db.execute(
+                    "SELECT id, position, name, url, tags, desc FROM bookmarks"
+                )
+            }
+            # rows that only moved keep their index entries and tags
+            upserts, moves, retagged, tags = [], [], [], []
+            for position, bm in enumerate(bookmarks):
+                content = (bm.name, bm.url, bm.tags, bm.desc)
+                old = stored.pop(bm.id, None)
+                if old is None or old[1] != content:
+                    keys = (fieldKey(bm.name), fieldKey(bm.url), fieldKey(bm.tags))
+                    upserts.append((bm.id, position, *content, *keys))
+                    if old is None or old[1][2] != bm.tags:
+                        retagged.append((bm.id,))
+                        tags += [(tag, bm.id) for tag in splitTags(keys[2])]
+                elif old[0] != position:
+                    moves.append((position, bm.id))
+
+            db.executemany("DELETE FROM bookmarks WHERE id = ?", [(i,) for i in stored])
+            db.executemany(
+                "DELETE FROM bookmark_tags"
+                " WHERE bookmark = (SELECT rowid FROM bookmarks WHERE id = ?)",
+                retagged,
+            )
+            db.executemany("UPDATE bookmarks SET position = ? WHERE id = ?", moves)
+            db.executemany(
+                """
+                INSERT INTO bookmarks
+                    (id, position, name, url, tags, desc, name_key, url_key, tags_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    position = excluded.position,
+                    name = excluded.name,
+                    url = excluded.url,
+                    tags = excluded.tags,
+                    desc = excluded.desc,
+                    name_key = excluded.name_key,
+                    url_key = excluded.url_key,
+                    tags_key = excluded.tags_key
+                """,
+                upserts,
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO bookmark_tags"
+                " SELECT ?, rowid FROM bookmarks WHERE id = ?",
+                tags,
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('stamp', ?)",
+                (" ".join(map(str, stamp or ())),),
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def close(self):
+        with self.queryLock:
+            self.closed = True
+            self.db.close()
+
+    def storedStamp(self, db):
+        row = db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+        return tuple(map(int, row[0].split())) or None if row else None
+
+
+class BookmarkSources(Reloader):
+    """Bookmarks of several CSV files searched as one.
+
+    Every file is a shard with a store of its own, parsed on the shared
+    thread pool and reloaded alone when it changes. Directories are listed
+    again on every check, picking up added and removed files. Results of
+    the shards are merged by rank, then in source order. With more than one
+    file their ids are prefixed with the file name, so they stay unique.
+    """
+
+    def __init__(self, sources: list[str], stats: QueryStats = None):
+        # threads, not processes: Albert embeds the interpreter
+        super().__init__(
+            ThreadPoolExecutor(LOAD_THREADS, thread_name_prefix="bookmarks")
+        )
+        self.sources = sources
+        self.stats = stats
+        self.shards = {}
+
+    def dataGeneration(self) -> tuple:
+        """Changes whenever the shards, or what one of them holds, change"""
+        self.refresh()
+        shards = self.shards
+        for store in shards.values():
+            store.refresh()
+
+        return (self.generation, *(store.generation for store in shards.values()))
+
+    def best(self, query: BookmarkQuery, limit: int, albertQuery=None) -> list[Bookmark]:
+        self.refresh()
+
+        ranked, shards = [], self.shards
+        for n, (path, store) in enumerate(shards.items()):
+            checkValid(albertQuery)
+            for i, bm in enumerate(store.best(query, limit, albertQuery)):
+                ranked.append((query.rank(bm), n, i, shardName(path), bm))
+
+        best = heapq.nsmallest(limit, ranked)
+        if len(shards) == 1:
+            return [bm for *_, bm in best]
+        return [dataclasses.replace(bm, id=f"{shard}:{bm.id}") for *_, shard, bm in best]
+
+    def reload(self):
+        try:
+            shards = {}
+            for path in sourceFiles(self.sources):
+                shards[path] = self.shards.get(path) or self.openShard(path)
+            if shards.keys() != self.shards.keys():
+                previous, self.shards = self.shards, shards
+                self.generation += 1
+                for path in previous.keys() - shards.keys():
+                    previous[path].close()
+        except OSError:  # keep what we have, retry on next check
+            pass
+        finally:
+            self.checking = False
+
+    def openShard(self, path: str):
+        store = None
+        if SIDECAR_INDEX:
+            try:
+                store = BookmarkDatabase(path, self.executor, self.stats)
+            except sqlite3.Error:  # no FTS5 trigram tokenizer, or unwritable directory
+                pass
+
+        if store is None:
+            store = BookmarkStore(path, self.executor, self.stats)
+
+        store.refresh()
+        return store
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for store in self.shards.values():
+            store.close()
+
+
+def sourceFiles(sources: list[str]) -> list[str]:
+    """The CSV files of sources, the files of a directory sorted by name"""
+    files = []
+    for source in sources:
+        if not os.path.isdir(source):
+            files.append(source)  # possibly not created yet
+            continue
+
+        with os.scandir(source) as entries:
+            files += sorted(
+                entry.path
+                for entry in entries
+                if entry.name.endswith(".csv")
+                and not entry.name.startswith(".")
+                and entry.is_file()
+            )
+
+    return files
+
+
+def shardName(path: str):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def intersectRarest(postings: list):
+    """Sorted positions in the two rarest postings, None if there are none.
+
+    The two rarest do most of the narrowing, past that checking the
+    candidates is cheaper than walking more postings.
+    """
+    if not postings:
+        return None
+
+    postings.sort(key=len)
+    if len(postings) == 1 or len(postings[1]) > 8 * len(postings[0]):
+        return postings[0]
+
+    return sorted(set(postings[0]).intersection(postings[1]))
+
+
+def ftsPhrase(text: str, column: str = None):
+    """An FTS5 query for text, in column or any, None if it is too short"""
+    if len(text) < 3:
+        return None
+
+    phrase = '"%s"' % text.replace('"', '""')
+    return f"{column} : {phrase}" if column else phrase
+
+
+def fieldKey(text: str) -> str:
+    """text lowercased, on one line: quoted CSV fields may span several"""
+    return text.lower().replace("\n", " ")
+
+
+def splitTags(tags: str) -> set[str]:
+    """Tags of a bookmark, separated by whitespace or commas"""
+    return set(TAG_SEPARATOR.split(tags)) - {""}
+
+
+def fileStamp(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def readBookmarks(path: str) -> list[Bookmark]:
+    bookmarks = []
+
+    with open(path, "r") as bmfile:
+        bmreader = csv.reader(bmfile)
+        next(bmreader, None)  # skip header
+
+        for row in bmreader:
+            if len(row) == 5:  # blank or partially written lines
+                bookmarks.append(Bookmark(*row))
+
+    return bookmarks
 
 
 class Plugin(QueryHandler):
@@ -57,14 +833,36 @@ class Plugin(QueryHandler):
         return md_description
 
     def synopsis(self):
-        return "<bookmark>"
+        return "<words> [tag:<tag>] [name:<text>] [url:<text>]"
 
     def defaultTrigger(self):
         return "bm "
 
+    def initialize(self):
+        self.stats = QueryStats("bookmarks", INSTRUMENT)
+        self.sources = BookmarkSources(BOOKMARKS_SOURCES, self.stats)
+        # lists the sources right away, their files load in the background
+        self.sources.reload()
+        self.results = ResultCache()
+
+    def finalize(self):
+        self.sources.close()
+        self.stats.close()
+
     def handleQuery(self, query):
+        self.stats.handleQuery(query, self.addMatchingItems, ICON)
+
+    def addMatchingItems(self, query):
         search: str = query.string.strip()
-        results = [self.itemForBookmark(b) for b in self.bookmarksMatching(search)]
+        with self.stats.phase("refresh"):
+            generation = self.sources.dataGeneration()
+
+        try:
+            results = self.results.get(
+                search, generation, lambda: self.itemsMatching(search, query)
+            )
+        except Cancelled:
+            return
 
         if len(results) > 0:
             query.add(results)
@@ -81,31 +879,27 @@ class Plugin(QueryHandler):
                 )
             )
 
-    def bookmarksMatching(self, search: str) -> list[Bookmark]:
-        results = []
-
-        with open(BOOKMARKS_CSV, "r") as bmfile:
-            bmreader = csv.reader(bmfile)
-            skip_header = True
-
-            for row in bmreader:
-                if skip_header:
-                    skip_header = False
-                    continue
-
-                bm = Bookmark(*row)
-
-                if bm.matches(search.lower()):
-                    results.append(bm)
+    def itemsMatching(self, search: str, albertQuery=None):
+        with self.stats.phase("parse"):
+            parsed = BookmarkQuery.parse(search)
+            # the url is the subtext, underline where the words found it
+            matcher = Matcher(" ".join(parsed.words + parsed.urls))
+        with self.stats.phase("search"):
+            bookmarks = self.sources.best(parsed, MAX_RESULTS, albertQuery)
+        with self.stats.phase("items"):
+            return [self.itemForBookmark(bm, matcher) for bm in bookmarks]
 
-        return results
+    def itemForBookmark(self, bm: Bookmark, matcher: Matcher = None):
+        subtext = bm.url
+        if matcher:
+            _, spans = matcher.score(*matchKey(bm.url))
+            subtext = highlight(bm.url, spans)
 
-    def itemForBookmark(self, bm: Bookmark):
         return Item(
             id=bm.id,
             icon=ICON,
             text=bm.name,
-            subtext=bm.url,
+            subtext=subtext,
             completion=f"bm {bm.url}",
             actions=[
                 Action("open", "Open URL", lambda: openUrl(bm.url)),
@@ -1,9 +1,28 @@
 # -*- coding: utf-8 -*-
 
-import fnmatch
+import bisect
+import ctypes
+import ctypes.util
+import itertools
+import json
 import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 from albert import Item, QueryHandler, Action, runDetachedProcess
 
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from plugin_common import Cancelled, ResultCache, cancellable, checkValid
+from plugin_common.instrument import QueryStats
+from plugin_common.matching import Matcher, highlight, matchKey
+
 md_iid = "0.5"
 md_version = "0.1"
 md_name = "Cuis"
@@ -16,11 +35,514 @@ HOME_DIR = os.environ["HOME"]
 CUIS_DIR = HOME_DIR + "/files/cuis-university"
 OPEN_IMAGE_SCRIPT = CUIS_DIR + "/open-image"
 CUIS_IMAGES_DIR = CUIS_DIR + "/images"
+# image trees, scanned concurrently; new images are created in CUIS_IMAGES_DIR
+CUIS_IMAGES_DIRS = [CUIS_IMAGES_DIR]
+SCAN_THREADS = min(4, os.cpu_count() or 1)
+# when each image was last opened from here
+OPENED_FILE = (
+    os.environ.get("XDG_DATA_HOME", HOME_DIR + "/.local/share") + "/albert/cuis-opened.json"
+)
 ICON = ["/home/jt/files/cuis-university/favicon.ico"]
 IMAGE_EXT = ".image"
+MAX_RESULTS = 30
+# order of equally good matches and of the empty query: "name" (shortest
+# path first; the empty query alphabetically), "modified" or "opened"
+IMAGE_ORDER = "name"
+# keep the image catalog current with inotify, else compare directory mtimes
+WATCH_IMAGES = True
+# seconds between mtime checks when not watching
+RESCAN_CHECK_INTERVAL = 2.0
+# time queries and count file reads, the query "stats" shows them
+INSTRUMENT = False
+
+# inotify(7)
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+# entries added, removed or renamed
+IN_ENTRY_CHANGES = (
+    IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+# files written to or touched, only images among them matter
+IN_FILE_CHANGES = IN_CLOSE_WRITE | IN_ATTRIB
+IN_DIRECTORY_CHANGES = IN_ENTRY_CHANGES | IN_FILE_CHANGES
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length, name
+
+# characters a path segment, or a word in it, starts after
+SEGMENT_SEPARATORS = "/-_. "
+
+
+class Image(NamedTuple):
+    path: str
+    key: str  # see imageKey
+    size: int
+    mtime: int  # ns
+
+
+class Directory(NamedTuple):
+    mtime: int
+    images: list[Image]
+    subdirs: list[str]
+
+
+def scanDirectory(root: str, path: str) -> Directory | None:
+    """The images, with their metadata, and subdirectories of path, None if it is gone"""
+    images = []
+    subdirs = []
+
+    try:
+        # stat first, a change while listing shows up as a newer mtime later
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # like os.walk: symlinked directories are listed, not entered
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif entry.name.endswith(IMAGE_EXT):
+                    key = imageKey(root, entry.path)
+                    try:
+                        st = entry.stat()
+                        images.append(Image(entry.path, key, st.st_size, st.st_mtime_ns))
+                    except OSError:  # a dangling symlink
+                        images.append(Image(entry.path, key, 0, 0))
+    except OSError:
+        return None
+
+    return Directory(mtime, images, subdirs)
+
+
+class ImageTree:
+    """The directories under one root, each listed with its mtime.
+
+    A directory's mtime changes when entries are added, removed or renamed
+    in it, only such directories are listed again. Without inotify, which
+    also reports images written to, that is also when the size and mtime of
+    its images are updated.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.normpath(root)  # no trailing slash, see imageKey
+        self.lock = threading.Lock()
+        self.dirs: dict[str, Directory] = {}
+
+    def images(self):
+        for d in self.dirs.values():
+            yield from d.images
+
+    def changed(self) -> list[str]:
+        return [path for path, d in self.dirs.items() if directoryMtime(path) != d.mtime]
+
+    def rescan(self, paths, watcher=None):
+        """List paths again, along with new subdirectories, and forget removed ones"""
+        with self.lock:
+            dirs = dict(self.dirs)
+            pending = list(paths)
+
+            while pending:
+                added, removed = self.scan(dirs, pending)
+                if watcher is not None:
+                    watcher.update(self, added, removed)
+                # changed before being watched, list them again
+                pending = [p for p in added if p in dirs and directoryMtime(p) != dirs[p].mtime]
+
+            self.dirs = dirs
+
+    def scan(self, dirs: dict[str, Directory], pending: list[str]):
+        """Update dirs from listing pending, returns the added and removed directories"""
+        added, removed = [], []
+        new_dirs = set()
+
+        while pending:
+            path = pending.pop()
+            if path not in dirs and path not in new_dirs and path != self.root:
+                continue  # no longer part of the tree
+            old = dirs.pop(path, None)
+            new = scanDirectory(self.root, path)
+
+            kept = set(new.subdirs) if new else set()
+            for subdir in old.subdirs if old else ():
+                if subdir not in kept:
+                    removed += forget(dirs, subdir)
+
+            if new is None:
+                if old is not None:
+                    removed.append(path)
+                continue
+            if old is None:
+                added.append(path)
+            dirs[path] = new
+            for subdir in new.subdirs:
+                if subdir not in dirs and subdir not in new_dirs:
+                    new_dirs.add(subdir)
+                    pending.append(subdir)
+
+        return added, removed
+
+
+class ImageCatalog:
+    """Every image under the roots, scanned once and kept current.
+
+    The roots are scanned concurrently on a thread pool, in the background;
+    queries find no images until that is done. Afterwards changed
+    directories are listed again, either when inotify reports a change or,
+    without it, when a background check finds a newer mtime. Queries only
+    rank the current ImageList, which is rebuilt after every change and
+    whenever an image is opened.
+    """
+
+    def __init__(self, roots: list[str], stats: QueryStats = None):
+        self.trees = [ImageTree(root) for root in outermostRoots(roots)]
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.opened: dict[str, float] = {}
+        self.images = ImageList([], self.opened)
+        self.generation = 0  # bumped whenever images changes
+        self.watcher = None
+        self.checking = False
+        self.checked = float("-inf")
+
+    def start(self):
+        if self.stats is not None:
+            self.stats.fileRead(OPENED_FILE)
+        self.opened = readOpened()
+
+        if WATCH_IMAGES:
+            try:
+                self.watcher = InotifyWatcher(self)
+            except OSError:  # no inotify, keep checking mtimes
+                pass
+
+        if self.watcher is not None:
+            self.watcher.start()
+
+        self.checking = True  # nothing to check before the first scan
+        threading.Thread(target=self.scan, name="cuis-scan", daemon=True).start()
+
+    def scan(self):
+        """Scan every root and publish the images, raising what a scan raised"""
+        try:
+            with ThreadPoolExecutor(SCAN_THREADS, thread_name_prefix="cuis-scan") as executor:
+                futures = [
+                    executor.submit(tree.rescan, [tree.root], self.watcher)
+                    for tree in self.trees
+                ]
+            for future in futures:
+                future.result()
+        finally:
+            self.checking = False
+            self.publish()
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def matching(self, search: str, limit: int, albertQuery=None) -> list[str]:
+        self.refresh()
+        return self.images.best(search, limit, albertQuery)
+
+    def rootOf(self, path: str) -> str:
+        roots = (tree.root for tree in self.trees if path.startswith(tree.root + "/"))
+        return next(roots, os.path.dirname(path))
+
+    def recordOpened(self, path: str):
+        with self.lock:
+            self.opened = {**self.opened, path: time.time()}
+            writeOpened(self.opened)
+        if IMAGE_ORDER == "opened":
+            self.publish()
+
+    def refresh(self):
+        """Check directory mtimes in the background, unless inotify reports changes"""
+        now = time.monotonic()
+
+        with self.lock:
+            if self.watcher is not None or self.checking:
+                return
+            if now - self.checked < RESCAN_CHECK_INTERVAL:
+                return
+            self.checking = True
+            self.checked = now
+
+        threading.Thread(target=self.check, daemon=True).start()
+
+    def check(self):
+        try:
+            changed = {tree: tree.changed() for tree in self.trees}
+            if any(changed.values()):
+                self.rescan(changed)
+        finally:
+            self.checking = False
+
+    def rescan(self, changed: dict[ImageTree, list[str]]):
+        for tree, paths in changed.items():
+            if paths:
+                tree.rescan(paths, self.watcher)
+        self.publish()
+
+    def publish(self):
+        with self.lock:
+            images = [image for tree in self.trees for image in tree.images()]
+            self.images = ImageList(images, self.opened)
+            self.generation += 1
+
+
+def outermostRoots(roots: list[str]) -> list[str]:
+    """roots normalized, in order, less repeats and roots inside another one"""
+    roots = list(dict.fromkeys(os.path.normpath(root) for root in roots))
+    return [
+        root for root in roots if not any(root.startswith(outer + "/") for outer in roots)
+    ]
+
+
+def forget(dirs: dict[str, Directory], path: str) -> list[str]:
+    """Remove path and the directories below it from dirs, returns them"""
+    d = dirs.pop(path, None)
+    if d is None:
+        return []
+
+    removed = [path]
+    for subdir in d.subdirs:
+        removed += forget(dirs, subdir)
+    return removed
+
+
+def directoryMtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def imageKey(root: str, path: str) -> str:
+    """The lowercase path of an image relative to root, without extension"""
+    return path[len(root) + 1 : -len(IMAGE_EXT)].lower().replace("\n", " ")
+
+
+def readOpened() -> dict[str, float]:
+    try:
+        with open(OPENED_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def writeOpened(opened: dict[str, float]):
+    os.makedirs(os.path.dirname(OPENED_FILE), exist_ok=True)
+    tmp = OPENED_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(opened, f)
+    os.replace(tmp, OPENED_FILE)
+
+
+class ImageList:
+    """Images in the order results are listed, see IMAGE_ORDER.
+
+    Their keys are joined into one text, a line each, which rankPatterns
+    scan with re. As images are in result order, each rank of matches stops
+    after the first hits.
+    """
+
+    def __init__(self, images: list[Image], opened: dict[str, float]):
+        if IMAGE_ORDER == "opened":
+            order = lambda i: (-opened.get(i.path, 0), -i.mtime, i.path)
+        elif IMAGE_ORDER == "modified":
+            order = lambda i: (-i.mtime, i.path)
+        else:
+            order = lambda i: (len(i.key), i.path)
+
+        images = sorted(images, key=order)
+        self.paths = [image.path for image in images]
+        if IMAGE_ORDER == "name":
+            self.listed = sorted(self.paths)
+        else:
+            self.listed = self.paths
+        # every line follows a newline, see rankPatterns
+        self.text = "".join("\n" + image.key for image in images)
+        lengths = (len(image.key) + 1 for image in images)
+        self.starts = list(itertools.accumulate(lengths, initial=1))
+        # a search with any other character matches nothing, without a scan
+        self.chars = frozenset(self.text)
+
+    def best(self, search: str, limit: int, albertQuery=None) -> list[str]:
+        """The limit best images for search, all in order if it is empty"""
+        if not search:
+            return self.listed[:limit]
+        if not self.chars.issuperset(search.replace(" ", "")):
+            return []
+
+        found = {}  # line -> None, in rank order
+        for pattern in rankPatterns(search):
+            checkValid(albertQuery)
+            for match in cancellable(albertQuery, pattern.finditer(self.text)):
+                # a match ends in its line, or right after the newline before it
+                found.setdefault(bisect.bisect_right(self.starts, match.end()) - 1)
+                if len(found) >= limit:
+                    return [self.paths[line] for line in found]
+
+        return [self.paths[line] for line in found]
+
+
+def rankPatterns(search: str) -> list[re.Pattern]:
+    """Patterns finding search in relative paths, one per rank, best first.
+
+    After the ranks of search as a whole, a search of several words matches
+    the paths holding all of them, at segment starts and then anywhere. Last
+    come the paths holding every word's characters in order.
+    """
+    escaped = re.escape(search)
+    # in a [...] class "-" would stand for a range
+    separators = re.escape(SEGMENT_SEPARATORS)
+    words = [re.escape(word) for word in search.split()]
+
+    # search comes first in these, so that re looks for it as a whole
+    patterns = [
+        # the name starts with search
+        re.compile(rf"{escaped}(?<=[\n/]{escaped})(?=[^/\n]*$)", re.M),
+        # a directory or word in the path starts with search
+        re.compile(rf"{escaped}(?<=[\n{separators}]{escaped})"),
+        re.compile(escaped),
+    ]
+    if len(words) > 1:
+        patterns += [
+            lineHolding(rf"[^\n]*?(?<=[\n{separators}]){word}" for word in words),
+            lineHolding(rf"[^\n]*?{word}" for word in words),
+        ]
+    # each character, then anything up to the next one's first occurrence:
+    # a line can only match one way, so a miss costs a pass over the line
+    patterns.append(
+        lineHolding(
+            "".join(f"[^\n{re.escape(c)}]*{re.escape(c)}" for c in word)
+            for word in search.split()
+        )
+    )
+    return patterns
+
+
+def lineHolding(patterns) -> re.Pattern:
+    """Pattern matching the newline before each line every one of patterns matches"""
+    return re.compile("\n" + "".join(f"(?={pattern})" for pattern in patterns))
+
+
+class InotifyWatcher:
+    """Tells the catalog which directories changed, from a thread of its own.
+
+    Falls back to the catalog's mtime checks if a watch cannot be added,
+    e.g. over the inotify watch limit.
+    """
+
+    def __init__(self, catalog: ImageCatalog):
+        self.catalog = catalog
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # written to on close, to wake the thread up
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.lock = threading.Lock()  # held while using fd
+        self.closeLock = threading.Lock()
+        self.closed = False
+        self.paths: dict[int, tuple[ImageTree, str]] = {}
+        self.watches: dict[str, int] = {}
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def close(self):
+        with self.closeLock:
+            if not self.closed:
+                self.closed = True
+                os.write(self.wakeup_w, b"x")
+
+    def update(self, tree: ImageTree, added: list[str], removed: list[str]):
+        with self.lock:
+            if self.closed:  # e.g. closed while the first scan ran
+                return
+            for path in removed:
+                wd = self.watches.pop(path, None)
+                if wd is not None:
+                    self.paths.pop(wd, None)
+                    self.libc.inotify_rm_watch(self.fd, wd)
+
+            for path in added:
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(path), IN_DIRECTORY_CHANGES | IN_ONLYDIR
+                )
+                if wd < 0:
+                    if ctypes.get_errno() == 2:  # ENOENT: gone already
+                        continue
+                    self.stop()
+                    return
+                self.paths[wd] = (tree, path)
+                self.watches[path] = wd
+
+    def stop(self):
+        """Hand over to the catalog's mtime checks"""
+        self.catalog.watcher = None
+        self.close()
+
+    def run(self):
+        try:
+            while True:
+                ready, _, _ = select.select([self.fd, self.wakeup_r], [], [])
+                if self.wakeup_r in ready:
+                    return
+
+                changed = {}
+                for wd, mask, name in self.events():
+                    if mask & IN_FILE_CHANGES and not name.endswith(IMAGE_EXT):
+                        continue  # .changes and friends are written all the time
+                    if mask & IN_Q_OVERFLOW:
+                        for tree in self.catalog.trees:
+                            changed.setdefault(tree, set()).update(tree.dirs)
+                    elif wd in self.paths:
+                        tree, path = self.paths[wd]
+                        changed.setdefault(tree, set()).add(path)
+
+                if changed:
+                    self.catalog.rescan(changed)
+        finally:
+            with self.lock, self.closeLock:
+                self.closed = True
+                os.close(self.fd)
+                os.close(self.wakeup_r)
+                os.close(self.wakeup_w)
+
+    def events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            # NUL padded, empty for events on the watched directory itself
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, name
 
 
 class Plugin(QueryHandler):
+    def initialize(self):
+        self.stats = QueryStats("cuis", INSTRUMENT)
+        self.catalog = ImageCatalog(CUIS_IMAGES_DIRS, self.stats)
+        self.catalog.start()
+        self.results = ResultCache()
+
+    def finalize(self):
+        self.catalog.close()
+        self.stats.close()
+
     def id(self):
         return md_id
 
@@ -37,44 +559,61 @@ class Plugin(QueryHandler):
         return "cuis "
 
     def handleQuery(self, query):
-        search: str = query.string.strip().lower()
-        results = [self.itemForImage(i) for i in self.cuisImagesMatching(search)]
+        self.stats.handleQuery(query, self.addMatchingItems, ICON)
 
-        if len(results):
-            query.add(results)
-        else:
-            query.add(self.createImageItem(query.string.strip()))
+    def addMatchingItems(self, query):
+        with self.stats.phase("refresh"):
+            self.catalog.refresh()
+
+        try:
+            results = self.results.get(
+                query.string.strip(),
+                self.catalog.generation,
+                lambda: self.itemsMatching(query),
+            )
+        except Cancelled:
+            return
 
-    def cuisImagesMatching(self, search: str) -> list[str]:
-        image_pattern = "*" + IMAGE_EXT
-        images: list[str] = []
+        query.add(results)
 
-        for root, _, filenames in os.walk(CUIS_IMAGES_DIR):
-            for filename in fnmatch.filter(filenames, image_pattern):
-                filename_noext = self.filenameWithoutExtension(filename)
-                if search in filename_noext.lower():
-                    images.append(os.path.join(root, filename))
+    def itemsMatching(self, query):
+        search: str = query.string.strip().lower()
+        with self.stats.phase("match"):
+            images = self.cuisImagesMatching(search, query)
+        with self.stats.phase("items"):
+            matcher = Matcher(search, fuzzy=True, separators=SEGMENT_SEPARATORS)
+            results = [self.itemForImage(i, matcher) for i in images]
 
-        images.sort()
+        if len(results):
+            return results
+        else:
+            return [self.createImageItem(query.string.strip())]
 
-        return images
+    def cuisImagesMatching(self, search: str, albertQuery=None) -> list[str]:
+        return self.catalog.matching(search, MAX_RESULTS, albertQuery)
 
-    def itemForImage(self, image_path: str):
+    def itemForImage(self, image_path: str, matcher: Matcher = None):
+        root = self.catalog.rootOf(image_path)
         relative_filename_noext = self.filenameWithoutExtension(
-            image_path[len(CUIS_IMAGES_DIR) + 1 :]
+            image_path[len(root) + 1 :]
         )
 
+        subtext = image_path
+        if matcher:
+            _, spans = matcher.score(*matchKey(relative_filename_noext, SEGMENT_SEPARATORS))
+            subtext = highlight(image_path, spans, offset=len(root) + 1)
+
         return Item(
             id=relative_filename_noext,
             icon=ICON,
             text=relative_filename_noext,
-            subtext=image_path,
+            subtext=subtext,
             completion="cuis " + relative_filename_noext,
             actions=[
                 Action(
                     "open",
                     "Open",
-                    lambda: runDetachedProcess([OPEN_IMAGE_SCRIPT, image_path]),
+                    lambda: self.openImage(image_path),
                 )
             ],
         )
@@ -92,10 +631,15 @@ class Plugin(QueryHandler):
                 Action(
                     "create",
                     "Create CUIS Image",
-                    lambda: runDetachedProcess([OPEN_IMAGE_SCRIPT, image_path]),
+                    lambda: self.openImage(image_path),
                 )
             ],
         )
 
+    def openImage(self, image_path: str):
+        with self.stats.spawn("open-image"):
+            runDetachedProcess([OPEN_IMAGE_SCRIPT, image_path])
+        self.catalog.recordOpened(image_path)
+
     def filenameWithoutExtension(self, path: str):
         return path[: -len(IMAGE_EXT)]
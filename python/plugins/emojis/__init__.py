@@ -1,16 +1,32 @@
 """Emoji picker."""
 
+import bisect
+import heapq
+import importlib.util
+import itertools
+import json
+import marshal
+import os
+import queue
 import subprocess
+import sys
+import threading
+import time
 import traceback
+from array import array
+from collections import Counter, defaultdict
+from collections.abc import Sequence
 from pathlib import Path
 from shutil import which
 
 import albert as v0
-import em
-from fuzzywuzzy import process
-from gi.repository import GdkPixbuf, Notify
 
-import pickle
+plugins_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if plugins_dir not in sys.path:
+    sys.path.append(plugins_dir)
+from plugin_common import Cancelled, ResultCache
+from plugin_common.instrument import QueryStats
+from plugin_common.matching import Corpus, Matcher, top
 
 __title__ = "Emoji picker"
 __version__ = "0.4.0"
@@ -20,7 +36,7 @@ __homepage__ = (
     "https://github.com/bergercookie/awesome-albert-plugins/blob/master/plugins/emoji"
 )
 __exec_deps__ = ["xclip"]
-__py_deps__ = ["em", "fuzzywuzzy"]
+__py_deps__ = ["em"]
 
 icon_path = str(Path(__file__).parent / "emoji.png")
 
@@ -28,85 +44,560 @@ cache_path = Path(v0.cacheLocation()) / "emoji"
 config_path = Path(v0.configLocation()) / "emoji"
 data_path = Path(v0.dataLocation()) / "emoji"
 dev_mode = True
-
-stats_path = config_path / "stats"
+# time queries, xclip calls and file reads, the query "stats" shows them
+instrument = False
+
+stats_path = config_path / "stats.json"
+stats_log_path = config_path / "stats.log"
+legacy_stats_path = config_path / "stats"  # a pickled dict of counts
+# logged copies that trigger rewriting stats_path and starting a new log
+stats_compact_every = 500
+# days after which a copy counts half as much as a new one, None to never fade
+stats_half_life = None
+recent_count = 10
+# parsed emojis and their label index, see load_emojis
+emoji_cache_path = cache_path / "emojis.marshal"
+emoji_cache_format = 3
+
+max_results = 30
+# labels sharing the most bigrams with the query that get fuzzy scored
+max_fuzzy_candidates = 50
+
+query_stats = QueryStats("emojis", instrument)
 
 # create plugin locations
 for p in (cache_path, config_path, data_path):
     p.mkdir(parents=False, exist_ok=True)
 
-if not stats_path.exists():
-    with stats_path.open("wb") as f:
-        pickle.dump({}, f)
-
 # plugin main functions -----------------------------------------------------------------------
 
-def parse_emojis():
-    global emojis, emojis_li, label_to_emoji_tuple
-    emojis = em.parse_emojis()
-    emojis_li = list(emojis.items())
 
-    # example:
-    # label:  'folded_hands'
-    # emoji_tuple:    ('🙏', ['folded_hands', 'please', 'hope', 'wish', 'namaste', 'highfive', 'pray'])
-    for emoji_tuple in emojis.items():
-        label_list = emoji_tuple[1]
-        for label in label_list:
-            label_to_emoji_tuple[label] = emoji_tuple
+class StringTable(Sequence):
+    """Strings stored back to back in one str.
 
+    String i is text[offsets[i]:offsets[i + 1]], so thousands of labels take
+    two objects instead of one str each.
+    """
 
-emojis_li = []
-emojis = {}
-label_to_emoji_tuple = {}
-parse_emojis()
-print("label_to_emoji_tuple: ", label_to_emoji_tuple)
+    def __init__(self, text: str, offsets: array):
+        self.text = text
+        self.offsets = offsets
 
-def update_emojis():
-    prev_len = len(emojis_li)
-    parse_emojis()
-    curr_len = len(emojis_li)
+    @classmethod
+    def pack(cls, strings: list):
+        offsets = array("I", [0])
+        for s in strings:
+            offsets.append(offsets[-1] + len(s))
+        return cls("".join(strings), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self.offsets) - 1:
+            raise IndexError(i)
+        return self.text[self.offsets[i] : self.offsets[i + 1]]
+
+    def length(self, i: int) -> int:
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def dump(self) -> tuple:
+        return self.text, self.offsets.tobytes()
+
+    @classmethod
+    def load(cls, state: tuple):
+        text, offsets = state
+        return cls(text, int_array(offsets))
+
+
+def int_array(data: bytes = b"") -> array:
+    a = array("I")
+    a.frombytes(data)
+    return a
+
+
+class LabelIndex:
+    """Emoji labels, sorted for exact and prefix hits.
+
+    Queries are first answered with the labels starting with them, shortest
+    first. Only when that leaves free slots are the labels sharing the most
+    character bigrams with the query fuzzy matched, instead of every label on
+    every keystroke. Those holding the query's characters in order come
+    first, best scored first, then the rest, which may hold a typo. Labels
+    are referred to by their position.
+    """
+
+    def __init__(self, labels: StringTable, keys: StringTable, bigrams: dict):
+        self.labels = labels
+        self.keys = keys  # the labels lowercased
+        self.bigrams = bigrams  # bigram -> array of label ids
+
+    @classmethod
+    def build(cls, labels):
+        labels = sorted(labels, key=str.lower)
+        keys = [label.lower() for label in labels]
+
+        bigrams = defaultdict(int_array)
+        for i, key in enumerate(keys):
+            for bigram in {key[j : j + 2] for j in range(len(key) - 1)}:
+                bigrams[bigram].append(i)
+
+        labels = StringTable.pack(labels)
+        # nearly every label is lowercase already, share the text then
+        keys = StringTable.pack(keys) if labels.text != labels.text.lower() else labels
+        return cls(labels, keys, dict(bigrams))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, query_str: str, limit: int = max_results, query=None) -> list:
+        """Ids of the labels matching query_str, best first.
+
+        Raises Cancelled once query, if given, is no longer valid.
+        """
+        query_str = "_".join(query_str.lower().split())
+        if not query_str:
+            return []
+
+        start = bisect.bisect_left(self.keys, query_str)
+        end = bisect.bisect_left(self.keys, query_str + "\U0010ffff", start)
+        # the exact label, if any, sorts first and is also the shortest
+        matched = heapq.nsmallest(limit, range(start, end), key=self.keys.length)
+
+        if len(matched) < limit:
+            found = set(matched)
+            candidates = [i for i in self.candidates(query_str) if i not in found]
+            corpus = Corpus.build([self.keys[i] for i in candidates], separators="_")
+            matcher = Matcher(query_str, fuzzy=True, separators="_")
+            scores, spans = matcher.scoreAll(corpus, query)
+            # matches, then those with a typo; equal scores keep bigram order
+            free = limit - len(matched)
+            ranked = top(scores, spans, free)
+            typos = [not matchPos for matchPos in spans]
+            ranked += top(scores, typos, free - len(ranked))
+            matched += [candidates[j] for j in ranked]
+
+        return matched
+
+    def candidates(self, query_str: str) -> list:
+        """Ids of the labels sharing the most bigrams with query_str, most first"""
+        if len(query_str) < 2:
+            found = (i for i, key in enumerate(self.keys) if query_str in key)
+            return list(itertools.islice(found, max_fuzzy_candidates))
+
+        bigrams = {query_str[j : j + 2] for j in range(len(query_str) - 1)}
+        shared = Counter()
+        for bigram in bigrams:
+            shared.update(self.bigrams.get(bigram, ()))
+
+        # a typo breaks up to two bigrams, more than half missing is noise
+        needed = max(1, len(bigrams) // 2)
+        best = heapq.nsmallest(
+            max_fuzzy_candidates, shared.items(), key=lambda item: (-item[1], item[0])
+        )
+        return [i for i, count in best if count >= needed]
+
+    def dump(self) -> dict:
+        return {
+            "labels": self.labels.dump(),
+            "keys": self.keys.dump() if self.keys is not self.labels else None,
+            "bigrams": {bigram: ids.tobytes() for bigram, ids in self.bigrams.items()},
+        }
+
+    @classmethod
+    def load(cls, state: dict):
+        labels = StringTable.load(state["labels"])
+        keys = StringTable.load(state["keys"]) if state["keys"] else labels
+        bigrams = {bigram: int_array(ids) for bigram, ids in state["bigrams"].items()}
+        return cls(labels, keys, bigrams)
+
+
+class EmojiIndex:
+    """Everything queries read, built in one go and never changed afterwards.
+
+    A re-index builds a new one and publishes it by rebinding emoji_index, so
+    a query always sees either the old index or the new one, whole.
+
+    Emojis are referred to by their position in em's list and labels by their
+    position in the label index. Which emoji a label picks and which labels
+    an emoji has are arrays of such ids, not per emoji lists and tuples.
+    """
+
+    def __init__(
+        self,
+        emojis: StringTable,
+        labels: LabelIndex,
+        label_emoji: array,
+        emoji_labels: array,
+        emoji_label_starts: array,
+        by_emoji: array,
+    ):
+        self.generation = next(index_generations)
+        self.emojis = emojis
+        self.labels = labels
+        # label id -> emoji id, e.g. 'folded_hands' -> '🙏'
+        self.label_emoji = label_emoji
+        # the label ids of emoji i, in em's order, are emoji_labels[starts[i]:starts[i + 1]]
+        self.emoji_labels = emoji_labels
+        self.emoji_label_starts = emoji_label_starts
+        # emoji ids sorted by emoji, to look emojis up by bisection
+        self.by_emoji = by_emoji
+
+    @classmethod
+    def build(cls, parsed: dict):
+        """Index em.parse_emojis(), a dict of emoji -> labels"""
+        emojis = StringTable.pack(list(parsed))
+        labels = LabelIndex.build({label for names in parsed.values() for label in names})
+        label_ids = {label: i for i, label in enumerate(labels.labels)}
+
+        label_emoji = array("I", [0]) * len(labels)
+        emoji_labels = array("I")
+        emoji_label_starts = array("I", [0])
+        for emoji_id, names in enumerate(parsed.values()):
+            for label in names:
+                label_emoji[label_ids[label]] = emoji_id  # the last emoji wins
+                emoji_labels.append(label_ids[label])
+            emoji_label_starts.append(len(emoji_labels))
+
+        by_emoji = array("I", sorted(range(len(emojis)), key=emojis.__getitem__))
+        return cls(emojis, labels, label_emoji, emoji_labels, emoji_label_starts, by_emoji)
+
+    def __len__(self):
+        return len(self.emojis)
+
+    def emoji_id(self, emoji: str):
+        """The id of emoji, None if it is not indexed"""
+        lo, hi = 0, len(self.by_emoji)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.emojis[self.by_emoji[mid]] < emoji:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self.by_emoji) and self.emojis[self.by_emoji[lo]] == emoji:
+            return self.by_emoji[lo]
+        return None
+
+    def record(self, emoji_id: int) -> tuple:
+        """What the item of an emoji shows, see emoji_record"""
+        start, end = self.emoji_label_starts[emoji_id : emoji_id + 2]
+        labels = [self.labels.labels[i] for i in self.emoji_labels[start:end]]
+        return emoji_record(self.emojis[emoji_id], labels)
+
+    def dump(self) -> dict:
+        return {
+            "emojis": self.emojis.dump(),
+            "labels": self.labels.dump(),
+            "label_emoji": self.label_emoji.tobytes(),
+            "emoji_labels": self.emoji_labels.tobytes(),
+            "emoji_label_starts": self.emoji_label_starts.tobytes(),
+            "by_emoji": self.by_emoji.tobytes(),
+        }
+
+    @classmethod
+    def load(cls, state: dict):
+        return cls(
+            StringTable.load(state["emojis"]),
+            LabelIndex.load(state["labels"]),
+            int_array(state["label_emoji"]),
+            int_array(state["emoji_labels"]),
+            int_array(state["emoji_label_starts"]),
+            int_array(state["by_emoji"]),
+        )
 
+
+def load_emojis():
+    """Load the emojis from the cache, parsing them only if it is missing or stale."""
+    with load_lock:
+        if emoji_index is None:
+            publish(read_emoji_cache() or parse_emojis())
+
+
+def read_emoji_cache():
+    query_stats.fileRead(str(emoji_cache_path))
+    try:
+        # a lot faster than marshal.load, which reads the file piecemeal
+        cache = marshal.loads(emoji_cache_path.read_bytes())
+
+        if cache["key"] == emoji_cache_key():
+            return EmojiIndex.load(cache["index"])
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+
+    return None
+
+
+def parse_emojis() -> EmojiIndex:
+    import em  # slow, it imports pkg_resources
+
+    index = EmojiIndex.build(em.parse_emojis())
+
+    cache = {"key": emoji_cache_key(), "index": index.dump()}
+    # the name is per thread, a reindex may race the first load
+    tmp_path = emoji_cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(marshal.dumps(cache))
+    tmp_path.replace(emoji_cache_path)
+
+    return index
+
+
+def emoji_cache_key() -> tuple:
+    """What the cache depends on: its format, python's marshal and the installed em."""
+    spec = importlib.util.find_spec("em")
+    st = os.stat(spec.origin)
+    return (emoji_cache_format, sys.version_info[:2], spec.origin, st.st_mtime_ns, st.st_size)
+
+
+def publish(index: EmojiIndex):
+    global emoji_index
+    emoji_index = index
+    # the cached results of older indexes are never asked for again
+    results_cache.clear()
+
+
+emoji_index = None  # loaded on the first query
+index_generations = itertools.count(1)
+load_lock = threading.Lock()
+reindex_lock = threading.Lock()
+
+
+def update_emojis():
+    """Re-index in the background, queries keep using the current index meanwhile."""
+    threading.Thread(target=reindex_emojis, name="emoji-reindex", daemon=True).start()
+
+
+def reindex_emojis():
+    if not reindex_lock.acquire(blocking=False):
+        notify(msg="Already re-indexing the emojis")
+        return
+
+    try:
+        load_emojis()  # in case no query came yet
+        prev_len = len(emoji_index)
+        start = time.perf_counter()
+        index = parse_emojis()
+        publish(index)
+        took = f"in {time.perf_counter() - start:.2f}s"
+    except Exception:
+        v0.critical(traceback.format_exc())
+        notify(msg="Re-indexing the emojis failed, see the albert log")
+        return
+    finally:
+        reindex_lock.release()
+
+    curr_len = len(index)
     if curr_len == prev_len:
-        notify(msg=f"Found no new emojis - Total emojis count: {curr_len}")
+        notify(msg=f"Found no new emojis {took} - Total emojis count: {curr_len}")
     else:
         diff = curr_len - prev_len
         notify(
-            msg=f'Found {diff} {"more" if diff > 0 else "less"} emojis - Total emojis count: {curr_len}'
+            msg=f'Found {diff} {"more" if diff > 0 else "less"} emojis {took} - Total emojis count: {curr_len}'
         )
 
 
-def get_stats():
-    with stats_path.open("rb") as f:
-        return pickle.load(f)
+class UsageStats:
+    """How often each emoji was copied, with the most used ones kept at hand.
 
+    Copies only touch memory. A background thread appends them to a log
+    and, every stats_compact_every copies, atomically rewrites the
+    snapshot and starts a new log. Both carry a log number, so a crash in
+    between never counts a copy twice. With stats_half_life set, each copy
+    weighs twice as much as one made a half-life earlier: old favourites
+    fade without the other scores ever being touched, and the top list can
+    still be updated one copy at a time.
+    """
 
-def update_stats(emoji: str):
-    stats = get_stats()
-    if emoji in stats:
-        stats[emoji] += 1
-    else:
-        stats[emoji] = 1
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scores = {}
+        self.epoch = time.time()
+        self.top = []
+
+        # what is on disk, owned by the flusher once it runs
+        self.persisted = {}
+        self.persisted_epoch = self.epoch
+        self.log_number = 0
+        self.logged = None  # copies in the current log, None if there is none
+
+        self.pending = queue.SimpleQueue()
+        self.flusher = None
 
-    with stats_path.open("wb") as f:
-        pickle.dump(stats, f)
+    def load(self):
+        query_stats.fileRead(str(stats_path))
+        query_stats.fileRead(str(stats_log_path))
+        try:
+            snapshot = json.loads(stats_path.read_text())
+            self.persisted = snapshot["scores"]
+            self.persisted_epoch = snapshot["epoch"]
+            self.log_number = snapshot["log"]
+        except FileNotFoundError:
+            self.load_legacy()
+        except (OSError, ValueError, KeyError):  # unreadable, start over
+            pass
+
+        try:
+            with stats_log_path.open() as f:
+                if f.readline() == f"log {self.log_number}\n":
+                    self.logged = 0
+                    for line in f:
+                        when, _, emoji = line.rstrip("\n").partition("\t")
+                        if emoji:  # not a torn last line
+                            self.persist(emoji, float(when))
+        except (OSError, ValueError):
+            pass
+
+        self.scores = dict(self.persisted)
+        self.epoch = self.persisted_epoch
+        self.top = heapq.nlargest(recent_count, self.scores, key=self.scores.get)
+
+    def load_legacy(self):
+        """Take over the counts of the pickle older versions kept."""
+        import pickle
+
+        try:
+            with legacy_stats_path.open("rb") as f:
+                self.persisted = {emoji: float(n) for emoji, n in pickle.load(f).items()}
+            self.compact()
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    def start(self):
+        self.flusher = threading.Thread(target=self.flush_forever, daemon=True)
+        self.flusher.start()
+
+    def stop(self):
+        if self.flusher is not None:
+            self.pending.put(None)
+            self.flusher.join(timeout=2)
+
+    def add(self, emoji: str):
+        when = time.time()
+        with self.lock:
+            score = self.scores.get(emoji, 0) + weight(when, self.epoch)
+            self.scores[emoji] = score
+            if emoji in self.top or len(self.top) < recent_count:
+                top = self.top if emoji in self.top else self.top + [emoji]
+            elif score > self.scores[self.top[-1]]:
+                top = self.top[:-1] + [emoji]
+            else:
+                top = None
+
+            if top is not None:  # replaced, not sorted in place, for readers
+                self.top = sorted(top, key=self.scores.get, reverse=True)
+
+        self.pending.put((when, emoji))
+
+    def most_used(self) -> list:
+        return self.top
+
+    def persist(self, emoji: str, when: float):
+        self.persisted[emoji] = self.persisted.get(emoji, 0) + weight(
+            when, self.persisted_epoch
+        )
+        self.logged += 1
+
+    def flush_forever(self):
+        while True:
+            entries = [self.pending.get()]
+            while not self.pending.empty():
+                entries.append(self.pending.get())
+
+            try:
+                self.flush([entry for entry in entries if entry is not None])
+                if self.logged and (self.logged >= stats_compact_every or None in entries):
+                    self.compact()
+            except OSError:
+                v0.critical(traceback.format_exc())
+
+            if None in entries:
+                return
+
+    def flush(self, entries: list):
+        if not entries:
+            return
+
+        if self.logged is None:
+            self.new_log()
+
+        with stats_log_path.open("a") as f:
+            f.writelines(f"{when}\t{emoji}\n" for when, emoji in entries)
+
+        for when, emoji in entries:
+            self.persist(emoji, when)
+
+    def compact(self):
+        now = time.time()
+        if stats_half_life is not None:
+            # keep weights small, scaling everything keeps the order
+            factor = weight(self.persisted_epoch, now)
+            self.persisted = {e: score * factor for e, score in self.persisted.items()}
+            self.persisted_epoch = now
+            with self.lock:
+                factor = weight(self.epoch, now)
+                self.scores = {e: score * factor for e, score in self.scores.items()}
+                self.epoch = now
+
+        snapshot = {
+            "epoch": self.persisted_epoch,
+            "log": self.log_number + 1,
+            "scores": self.persisted,
+        }
+        write_atomically(stats_path, json.dumps(snapshot, ensure_ascii=False))
+        self.log_number += 1
+        self.new_log()
+        legacy_stats_path.unlink(missing_ok=True)
+
+    def new_log(self):
+        write_atomically(stats_log_path, f"log {self.log_number}\n")
+        self.logged = 0
+
+
+def weight(when: float, epoch: float) -> float:
+    """What a copy at when counts, relative to one at epoch"""
+    if stats_half_life is None:
+        return 1.0
+
+    return 2 ** ((when - epoch) / (stats_half_life * 86400))
+
+
+def write_atomically(path: Path, text: str):
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text)
+    tmp_path.replace(path)
+
+
+usage_stats = UsageStats()
 
 
 def copy_emoji(emoji: str):
-    update_stats(emoji)
-    subprocess.run(f"echo {emoji} | xclip -r -selection clipboard", shell=True)
+    usage_stats.add(emoji)
+    with query_stats.spawn("xclip"):
+        subprocess.run(f"echo {emoji} | xclip -r -selection clipboard", shell=True)
 
 
 def initialize():
     """Called when the extension is loaded (ticked in the settings) - blocking."""
-    pass
+    usage_stats.load()
+    usage_stats.start()
 
 
 def finalize():
-    pass
+    usage_stats.stop()
+    query_stats.close()
 
 
 def handleQuery(query) -> list:
     """Hook that is called by albert with *every new keypress*."""  # noqa
+    with query_stats.query():
+        results = query_results(query)
+        if query.isTriggered and query_stats.isStatsQuery(query.string):
+            results.insert(0, get_stats_item())
+        return results
+
+
+def query_results(query) -> list:
+    """The items for query, see handleQuery"""
     results = []
 
     if query.isTriggered:
@@ -117,37 +608,24 @@ def handleQuery(query) -> list:
             if results_setup:
                 return results_setup
 
-            query_str = query.string
+            if emoji_index is None:
+                with query_stats.phase("load"):
+                    load_emojis()
 
-            if not query_str:
-                results.append(get_reindex_item())
-                recent = [
-                    k
-                    for k, _ in sorted(
-                        get_stats().items(), key=lambda item: item[1], reverse=True
-                    )[:10]
-                ]
-                results.extend([get_emoji_as_item((emoji, emojis[emoji])) for emoji in recent])
-
-                if len(results) < 30:
-                    results.extend(
-                        get_emoji_as_item(emoji_tuple)
-                        for emoji_tuple in emojis_li[: 30 - len(results)]
-                    )
-            else:
-                matched = process.extract(
-                    query_str, list(label_to_emoji_tuple.keys()), limit=30
-                )
-                # print("label_to_emoji_tuple.keys(): ", label_to_emoji_tuple.keys())
-                # print("query_str: ", query_str)
-                # print("matched: ", matched)
-                # print("type(matched): ", type(matched))
-                matched_emojis = list(
-                    dict([label_to_emoji_tuple[label] for label, *_ in matched]).items()
-                )
-                results.extend(
-                    [get_emoji_as_item(emoji_tuple) for emoji_tuple in matched_emojis]
+            index = emoji_index
+            query_str = query.string
+            # the empty query shows the most used emojis, which change with use
+            recent = () if query_str else tuple(usage_stats.most_used())
+            results.extend(
+                results_cache.get(
+                    (query_str, recent),
+                    index.generation,
+                    lambda: get_results(query_str, index, recent, query),
                 )
+            )
+
+        except Cancelled:  # a newer keypress superseded this query
+            return []
 
         except Exception:  # user to report error
             if dev_mode:  # let exceptions fly!
@@ -172,17 +650,54 @@ def handleQuery(query) -> list:
     return results
 
 
+# the items of recent queries, see get_results
+results_cache = ResultCache(maxsize=128)
+
+
+def get_results(query_str: str, index: EmojiIndex, recent: tuple, query=None) -> tuple:
+    """The items for query_str, the same ones while neither the index nor recent change."""
+    if query_str:
+        with query_stats.phase("match"):
+            matched = index.labels.search(query_str, query=query)
+        with query_stats.phase("items"):
+            emoji_ids = dict.fromkeys(index.label_emoji[i] for i in matched)
+            return tuple(get_emoji_as_item(index.record(i)) for i in emoji_ids)
+
+    results = [get_reindex_item()]
+    recent_ids = [i for i in map(index.emoji_id, recent) if i is not None]
+    results.extend(get_emoji_as_item(index.record(i)) for i in recent_ids)
+    for i in range(len(index)):
+        if len(results) >= max_results:
+            break
+        if i not in recent_ids:
+            results.append(get_emoji_as_item(index.record(i)))
+
+    return tuple(results)
+
+
 # supplementary functions ---------------------------------------------------------------------
 def notify(
     msg: str,
     app_name: str = __title__,
     image=str(icon_path),
 ):
+    from gi.repository import Notify
+
     Notify.init(app_name)
     n = Notify.Notification.new(app_name, msg, image)
     n.show()
 
 
+def get_stats_item():
+    title, line, text = query_stats.report()
+    return get_as_item(
+        text=title,
+        subtext=line,
+        completion=f"{__triggers__}stats",
+        actions=[v0.ClipAction("Copy stats", text)],
+    )
+
+
 def get_reindex_item():
     return get_as_item(
         text="Re-index list of emojis",
@@ -238,25 +753,32 @@ def get_as_item(*, text: str, actions: list, subtext: str = None, completion: st
     )
 
 
-def get_emoji_as_item(emoji_tuple: tuple):
-    """Return an item - ready to be appended to the items list and be rendered by Albert."""
-    emoji = emoji_tuple[0]
-    labels = [label.replace("_", " ") for label in emoji_tuple[1]]
+def emoji_record(emoji: str, labels: list) -> tuple:
+    """What the item of an emoji shows: (emoji, text, subtext, completion, url)"""
+    labels = [label.replace("_", " ") for label in labels]
     main_label = labels[0]
 
-    text = f"{emoji} {main_label}"
-    subtext = " | ".join(labels[1:])
+    return (
+        emoji,
+        f"{emoji} {main_label}",
+        " | ".join(labels[1:]),
+        f"{__triggers__}{main_label}",
+        f"https://www.google.com/search?q={main_label} emoji",
+    )
+
+
+def get_emoji_as_item(record: tuple):
+    """Return an item - ready to be appended to the items list and be rendered by Albert."""
+    emoji, text, subtext, completion, url = record
     return v0.Item(
         id=__title__,
         icon=icon_path,
         text=text,
         subtext=subtext,
-        completion=f"{__triggers__}{main_label}",
+        completion=completion,
         actions=[
             v0.FuncAction(f"Copy this emoji", lambda emoji=emoji: copy_emoji(emoji)),
-            v0.UrlAction(
-                f"Google this emoji", f"https://www.google.com/search?q={main_label} emoji"
-            ),
+            v0.UrlAction(f"Google this emoji", url),
         ],
     )
 
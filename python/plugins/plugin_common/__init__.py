@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pieces shared by the plugins: a cache of query results and checks that stop
+work on queries a newer keystroke superseded. The matching submodule scores
+searches against keys the same way for all of them, the instrument
+submodule times their queries when asked to.
+
+Albert loads every plugin on its own, so they reach this module through the
+plugins directory, appended to the path so that it shadows no other module:
+
+    PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if PLUGINS_DIR not in sys.path:
+        sys.path.append(PLUGINS_DIR)
+    from plugin_common import Cancelled, ResultCache, cancellable
+"""
+
+import threading
+from collections import OrderedDict
+
+# items between two looks at query.isValid, it crosses into Albert
+CHECK_EVERY = 512
+
+
+class Cancelled(Exception):
+    """The query was superseded, its results would not be shown"""
+
+
+def checkValid(query):
+    """Raise Cancelled once Albert no longer waits for query's results"""
+    if query is not None and not query.isValid:
+        raise Cancelled
+
+
+def cancellable(query, iterable, every: int = CHECK_EVERY):
+    """iterable, checking every so many items whether query is still valid"""
+    if query is None:
+        return iterable
+    return checkedEvery(query, iterable, every)
+
+
+def checkedEvery(query, iterable, every: int):
+    for i, item in enumerate(iterable):
+        if i % every == 0 and not query.isValid:
+            raise Cancelled
+        yield item
+
+
+class ResultCache:
+    """Results of recent queries, keyed by query and data generation.
+
+    The generation is whatever identifies the data the results were computed
+    from, anything hashable. New data comes with a new generation, so older
+    results are never returned and just age out; a generation of None means
+    the data is not known to stay put and nothing is cached. The least
+    recently used entry goes once there are maxsize.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, search, generation, compute):
+        """The results for search, from compute() unless cached.
+
+        When compute raises, e.g. Cancelled, nothing is cached.
+        """
+        if generation is None:
+            return compute()
+
+        key = (search, generation)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        results = compute()
+
+        with self.lock:
+            self.entries[key] = results
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return results
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
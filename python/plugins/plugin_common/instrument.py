@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in timing of the plugins' queries.
+
+A plugin keeps a QueryStats, enabled by one of its settings or for every
+plugin by setting $ALBERT_PLUGIN_STATS to 1. Its handleQuery runs inside
+stats.query() and the steps of a query inside stats.phase(name):
+
+    with stats.query():
+        with stats.phase("match"):
+            ...
+
+Plugins of the v0.5 API leave that to stats.handleQuery(query, handler),
+which also adds the stats item.
+
+Subprocesses are run inside stats.spawn(command) and file reads reported
+with stats.fileRead(path); while a query runs on the same thread they
+count towards it, otherwise towards the background. Durations go into
+histograms of the latest ROLLING_WINDOW to twice as many samples, which are
+written to STATS_DIR/<plugin>.json in the background every FLUSH_INTERVAL
+seconds, and by close(). A query of exactly STATS_QUERY gets an item with
+the p50/p99 of every phase.
+
+Disabled, every call is a no-op.
+"""
+
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+ENV_FLAG = "ALBERT_PLUGIN_STATS"
+STATS_QUERY = "stats"
+STATS_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "albert", "stats"
+)
+FLUSH_INTERVAL = 10.0
+# samples per histogram window, the older window is dropped when one fills up
+ROLLING_WINDOW = 1000
+# histogram buckets grow by this factor, percentiles are within its error
+BUCKET_GROWTH = 1.1
+SMALLEST_BUCKET = 1e-6  # seconds
+
+# shared by every disabled phase and spawn, nullcontext can be reentered
+NOTHING = contextlib.nullcontext()
+
+
+class Histogram:
+    """Durations in logarithmic buckets, rolling over two windows"""
+
+    def __init__(self):
+        self.current = Counter()
+        self.previous = Counter()
+        self.count = 0  # in current
+        self.total = 0  # ever added
+
+    def add(self, seconds: float):
+        if self.count >= ROLLING_WINDOW:
+            self.previous, self.current, self.count = self.current, Counter(), 0
+        self.current[bucketOf(seconds)] += 1
+        self.count += 1
+        self.total += 1
+
+    def percentile(self, p: float) -> float:
+        """Seconds, the upper bound of the bucket holding the p-th percentile"""
+        buckets = self.current + self.previous
+        wanted = p / 100 * sum(buckets.values())
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= wanted:
+                return bucketBound(bucket)
+        return 0.0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.total,
+            "p50Ms": self.percentile(50) * 1000,
+            "p99Ms": self.percentile(99) * 1000,
+        }
+
+
+def bucketOf(seconds: float) -> int:
+    if seconds <= SMALLEST_BUCKET:
+        return 0
+    return math.ceil(math.log(seconds / SMALLEST_BUCKET, BUCKET_GROWTH))
+
+
+def bucketBound(bucket: int) -> float:
+    return SMALLEST_BUCKET * BUCKET_GROWTH**bucket
+
+
+class QueryRecord:
+    """What happened during one query"""
+
+    def __init__(self):
+        self.phases = Counter()  # name -> seconds
+        self.spawns = 0
+        self.reads = 0
+
+
+class QueryStats:
+    """Timings, subprocess spawns and file reads of a plugin's queries"""
+
+    def __init__(self, plugin: str, enabled: bool = False):
+        self.plugin = plugin
+        self.enabled = enabled or os.environ.get(ENV_FLAG) == "1"
+        self.path = os.path.join(STATS_DIR, plugin + ".json")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phases: dict[str, Histogram] = {}
+        self.spawns: dict[str, Histogram] = {}
+        self.spawnsPerQuery = Counter()  # spawns -> queries
+        self.readsPerQuery = Counter()  # reads -> queries
+        self.backgroundReads = 0
+        self.flushed = time.monotonic()
+
+    def query(self):
+        """Context of a whole handleQuery, timed as the "total" phase"""
+        if not self.enabled:
+            return NOTHING
+        return self.timedQuery()
+
+    @contextlib.contextmanager
+    def timedQuery(self):
+        record = self.local.record = QueryRecord()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record.phases["total"] = time.perf_counter() - start
+            self.local.record = None
+            self.add(record)
+
+    def phase(self, name: str):
+        """Context of a step of the query, repeated steps add up"""
+        if not self.enabled:
+            return NOTHING
+        return self.timedPhase(name)
+
+    @contextlib.contextmanager
+    def timedPhase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = getattr(self.local, "record", None)
+            if record is not None:
+                record.phases[name] += time.perf_counter() - start
+
+    def spawn(self, command: str):
+        """Context running the subprocess command"""
+        if not self.enabled:
+            return NOTHING
+        return self.timedSpawn(command)
+
+    @contextlib.contextmanager
+    def timedSpawn(self, command: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            record = getattr(self.local, "record", None)
+            if record is not None:
+                record.spawns += 1
+            with self.lock:
+                self.spawns.setdefault(command, Histogram()).add(seconds)
+
+    def fileRead(self, path: str):
+        if not self.enabled:
+            return
+        record = getattr(self.local, "record", None)
+        if record is not None:
+            record.reads += 1
+        else:
+            with self.lock:
+                self.backgroundReads += 1
+
+    def add(self, record: QueryRecord):
+        with self.lock:
+            for name, seconds in record.phases.items():
+                self.phases.setdefault(name, Histogram()).add(seconds)
+            self.spawnsPerQuery[record.spawns] += 1
+            self.readsPerQuery[record.reads] += 1
+
+            now = time.monotonic()
+            flush = now - self.flushed >= FLUSH_INTERVAL
+            if flush:
+                self.flushed = now
+
+        if flush:  # off the query's thread, which is waiting to show results
+            threading.Thread(
+                target=self.flush, name=f"{self.plugin}-stats", daemon=True
+            ).start()
+
+    def summary(self) -> dict:
+        with self.lock:
+            queries = sum(self.spawnsPerQuery.values())
+            return {
+                "plugin": self.plugin,
+                "updated": time.time(),
+                "queries": queries,
+                "phases": {name: h.summary() for name, h in self.phases.items()},
+                "spawns": {command: h.summary() for command, h in self.spawns.items()},
+                "spawnsPerQuery": mean(self.spawnsPerQuery),
+                "readsPerQuery": mean(self.readsPerQuery),
+                "backgroundReads": self.backgroundReads,
+            }
+
+    def flush(self):
+        """Writes the summary to self.path, replacing the previous one"""
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(STATS_DIR, exist_ok=True)
+            tmp = "%s.%d.tmp" % (self.path, threading.get_ident())
+            with open(tmp, "w") as f:
+                json.dump(self.summary(), f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError:  # stats are not worth failing a query over
+            pass
+
+    def isStatsQuery(self, string: str) -> bool:
+        return self.enabled and string.strip() == STATS_QUERY
+
+    def report(self) -> tuple:
+        """(title, one line of p50/p99 per phase, all of it as lines of text)"""
+        summary = self.summary()
+        title = "%s stats: %d queries, %.1f spawns and %.1f file reads per query" % (
+            self.plugin,
+            summary["queries"],
+            summary["spawnsPerQuery"],
+            summary["readsPerQuery"],
+        )
+        timings = [("", summary["phases"]), ("spawn ", summary["spawns"])]
+        line = ", ".join(
+            "%s%s %.2f/%.2f ms" % (prefix, name, s["p50Ms"], s["p99Ms"])
+            for prefix, histograms in timings
+            for name, s in histograms.items()
+        )
+        text = [
+            title,
+            "p50/p99 per phase over its last %d to %d samples:"
+            % (ROLLING_WINDOW, 2 * ROLLING_WINDOW),
+        ]
+        text += [
+            "  %s%-12s %8.2f ms %8.2f ms  (%d)"
+            % (prefix, name, s["p50Ms"], s["p99Ms"], s["count"])
+            for prefix, histograms in timings
+            for name, s in histograms.items()
+        ]
+        text.append("background file reads: %d" % summary["backgroundReads"])
+        text.append("written to %s" % self.path)
+        return title, line or "no queries yet", "\n".join(text)
+
+    def item(self, icon=None):
+        """The report as an item of Albert's v0.5 API, its action copies all of it"""
+        from albert import Action, Item, setClipboardText
+
+        title, line, text = self.report()
+        return Item(
+            id=f"{self.plugin}-stats",
+            icon=icon,
+            text=title,
+            subtext=line,
+            actions=[Action("copy", "Copy stats", lambda: setClipboardText(text))],
+        )
+
+    def handleQuery(self, query, handler, icon=None):
+        """Runs handler(query) as a query, after adding item() for STATS_QUERY"""
+        with self.query():
+            if self.isStatsQuery(query.string):
+                query.add(self.item(icon))
+            handler(query)
+
+    def close(self):
+        self.flush()
+
+
+def mean(counts: Counter) -> float:
+    total = sum(counts.values())
+    return sum(value * n for value, n in counts.items()) / total if total else 0.0
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matching a search against many keys, ranked the same way in every plugin.
+
+Keys are normalized once, when the data is loaded: foldKey lowercases them
+and wordStarts notes where their words begin. A search is compiled once per
+query into a Matcher, which then scores a whole Corpus of keys:
+
+    corpus = Corpus.build(titles)
+    scores, spans = Matcher("gh pull", fuzzy=True).scoreAll(corpus)
+    for i in top(scores, spans, 10):
+        print(titles[i], scores[i], highlight(titles[i], spans[i]))
+
+Each token of the search is scored on its own, the scores add up and a key
+matching any token is a match. A token matching at the very start of a key
+scores FULL_MATCH, otherwise matches nearer the start and at word starts
+score better, and fuzzy matches lose for every character skipped.
+
+Window-switcher and emojis rank with these scores and pick their results
+with top. Bookmarks and Cuis are left out of the engine on purpose: they
+rank by tiers of their own, in SQL, trigram postings or regex passes that
+stop early instead of scoring every key. They only use Matcher.score to
+highlight their results, whose keys matchKey remembers.
+"""
+
+import functools
+import heapq
+from html import escape
+from typing import NamedTuple
+
+from plugin_common import cancellable
+
+# a token matching right at the start of a key, nothing else comes close
+FULL_MATCH = 100
+WORD_START_BONUS = 1.2
+# taken off per skipped character, relative to the matched length
+FUZZY_PENALTY = 2.3
+# texts matchKey remembers, some pages of results
+MATCH_KEYS_KEPT = 1024
+
+
+class Corpus(NamedTuple):
+    """Normalized keys and the offsets their words start at"""
+
+    keys: list
+    wordStarts: list
+
+    @classmethod
+    def build(cls, texts, separators: str = " "):
+        keys = [foldKey(text) for text in texts]
+        return cls(keys, [wordStarts(key, separators) for key in keys])
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def foldKey(text: str) -> str:
+    """text lowercased, keeping every character at its offset"""
+    folded = text.lower()
+    if len(folded) != len(text):  # "İ" lowers to two chars
+        folded = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+    return folded
+
+
+def wordStarts(key: str, separators: str = " ") -> frozenset:
+    """Offsets in key that follow one of separators, and 0"""
+    return frozenset([0] + [i + 1 for i, c in enumerate(key) if c in separators])
+
+
+@functools.lru_cache(maxsize=MATCH_KEYS_KEPT)
+def matchKey(text: str, separators: str = " ") -> tuple:
+    """(foldKey, wordStarts) of a text met again and again, like a result's"""
+    key = foldKey(text)
+    return key, wordStarts(key, separators)
+
+
+class Matcher:
+    """A search compiled for scoring many keys.
+
+    With fuzzy a token matches wherever its characters appear in order,
+    otherwise only where it appears as a whole. separators must be the ones
+    the keys' word starts were computed with.
+    """
+
+    def __init__(self, search: str, fuzzy: bool = False, separators: str = " "):
+        self.tokens = foldKey(search).split()
+        self.fuzzy = fuzzy
+        self.separators = separators
+
+    def __bool__(self):
+        return bool(self.tokens)
+
+    def tokenMatcher(self, token: str):
+        """function(key, wordStarts) -> (score, spans) for one token"""
+        if self.fuzzy:
+            separators = self.separators
+            return lambda key, starts: fuzzyMatch(key, starts, token, separators)
+        return lambda key, starts: substringMatch(key, starts, token)
+
+    def score(self, key: str, starts) -> tuple:
+        """(score, spans) of one key, spans are empty if it does not match"""
+        score, spans = 0, []
+        for token in self.tokens:
+            tokenScore, tokenSpans = self.tokenMatcher(token)(key, starts)
+            if tokenSpans:
+                score += tokenScore
+                spans.extend(tokenSpans)
+        return score, spans
+
+    def scoreAll(self, corpus: Corpus, albertQuery=None) -> tuple:
+        """(scores, spans) of every key in corpus, one token at a time.
+
+        Raises Cancelled once albertQuery, if given, is no longer valid.
+        """
+        keys, starts = corpus
+        scores = [0] * len(keys)
+        spans = [[] for _ in keys]
+
+        for token in self.tokens:
+            match = self.tokenMatcher(token)
+            for i in cancellable(albertQuery, range(len(keys))):
+                score, matchPos = match(keys[i], starts[i])
+                if matchPos:
+                    scores[i] += score
+                    spans[i].extend(matchPos)
+
+        return scores, spans
+
+
+def top(scores: list, spans: list, k: int) -> list:
+    """Indices of the k best scored keys with spans, best first, ties in corpus order"""
+    return heapq.nlargest(
+        k, (i for i, matched in enumerate(spans) if matched), key=scores.__getitem__
+    )
+
+
+def substringMatch(key: str, starts, token: str) -> tuple:
+    """Score of the best occurrence of token in key, spans of all of them"""
+    find, size = key.find, len(token)
+    score, spans = 0, []
+
+    pos = find(token)
+    while pos >= 0:
+        if pos == 0:
+            score = FULL_MATCH
+        else:
+            score = max(
+                score, 1.0 / (1 + pos) + (WORD_START_BONUS if pos in starts else 0.0)
+            )
+        spans.append((pos, pos + size))
+        pos = find(token, pos + size)
+
+    return score, spans
+
+
+def fuzzyMatch(key: str, starts, token: str, separators: str = " ") -> tuple:
+    """Best alignment of token as a subsequence of key, fzf style.
+
+    Matched greedily, every start gives its shortest match. Starts before the
+    same next character share the rest of the match, and within such a group
+    the score is convex in the start, so only the first and last start and
+    the first and last word start of a group can be the best. Matched
+    positions only move right from one group to the next, so this is one
+    forward sweep over key. Spans cover just the matched characters.
+    """
+    find, rfind = key.find, key.rfind
+    first = token[0]
+    start = find(first)
+    if start < 0:
+        return 0, []
+
+    wordFirsts = [sep + first for sep in separators]
+    size = len(token)
+    # matched[j]: where token[j] lands, matching greedily from start
+    matched = [-1] * size
+    bestScore, bestMatch = None, None
+
+    while start >= 0:
+        pos = start
+        for j in range(1, size):
+            if matched[j] > pos:
+                break  # nothing between the old and new position, rest holds
+            pos = find(token[j], pos + 1)
+            if pos < 0:
+                break
+            matched[j] = pos
+
+        if pos < 0:  # neither this nor any later start completes a match
+            break
+
+        groupEnd = matched[1] if size > 1 else len(key)
+        lastStart = rfind(first, start, groupEnd)
+        candidates = {start, lastStart}
+        for wordFirst in wordFirsts:
+            for wordStart in (
+                find(wordFirst, start, lastStart + 1),
+                rfind(wordFirst, start, lastStart + 1),
+            ):
+                if wordStart >= 0:
+                    candidates.add(wordStart + 1)
+
+        for candidate in sorted(candidates):
+            length = (matched[-1] if size > 1 else candidate) + 1 - candidate
+            if candidate == 0 and length == size:
+                newscore = FULL_MATCH
+            else:
+                newscore = (
+                    1.0 / (1 + candidate)
+                    + (WORD_START_BONUS if candidate in starts else 0.0)
+                    + (FUZZY_PENALTY * (size - length)) / length
+                )
+
+            # ties go to the earlier start
+            if bestScore is None or newscore > bestScore:
+                bestScore, bestMatch = newscore, [candidate] + matched[1:]
+
+        start = find(first, lastStart + 1)
+
+    if bestScore is None:
+        return 0, []
+
+    spans = []
+    for i in bestMatch:
+        if spans and spans[-1][1] == i:
+            spans[-1] = (spans[-1][0], i + 1)
+        else:
+            spans.append((i, i + 1))
+
+    return max(bestScore, 0), spans
+
+
+def highlight(text: str, spans, offset: int = 0) -> str:
+    """text as markup with the spans, shifted by offset, underlined.
+
+    Spans may overlap, as tokens can match the same characters. Without
+    spans text is returned as is, plain text rather than markup.
+    """
+    if not spans:
+        return text
+
+    merged = []
+    for start, end in sorted(spans):
+        start, end = start + offset, end + offset
+        if merged and start < merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    parts, last = [], 0
+    for start, end in merged:
+        parts.append("%s<u>%s</u>" % (escape(text[last:start]), escape(text[start:end])))
+        last = end
+    parts.append(escape(text[last:]))
+    return "".join(parts)
@@ -5,25 +5,52 @@ X11 window switcher - list and activate windows.
 to enable search on all workspaces start query with *
 performs tokenized search-> order doesnt matter
 fuzzy search can be enabled in settings
+with python-xlib installed the window list is cached and kept up to date from
+X events, otherwise wmctrl is queried on every keystroke
 """
 
+import heapq
+import os
+import select
 import subprocess
+import sys
+import threading
 from collections import namedtuple
-from collections import defaultdict
-from functools import reduce
-
-# from fuzzywuzzy import fuzz #https://chairnerd.seatgeek.com/fuzzywuzzy-fuzzy-string-matching-in-python/
-import re
 
 from albert import *
 
+PLUGINS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PLUGINS_DIR not in sys.path:
+    sys.path.append(PLUGINS_DIR)
+from plugin_common import Cancelled, ResultCache
+from plugin_common.instrument import QueryStats
+from plugin_common.matching import Corpus, Matcher, foldKey, highlight, top, wordStarts
+
+try:
+    from Xlib import X, Xatom, error as xerror
+    from Xlib.display import Display
+    from Xlib.protocol import event as xevent, request as xrequest
+except ImportError:  # no live updates, windows are fetched with wmctrl
+    Display = None
+
 Window = namedtuple("Window", ["wid", "desktop", "wm_class", "host", "wm_name"])
+# what the last scoring pass saw, lets a longer query rescore only its hits
+FilterState = namedtuple("FilterState", ["query", "curWS", "fuzzy", "entries", "hits"])
+# everything filterWindows and createItems need, computed once per window
+IndexEntry = namedtuple(
+    "IndexEntry",
+    ["window", "description", "folded", "wordStarts", "text", "subtext", "sortKey"],
+)
+# properties are read in parts of this many 32-bit units, enough for nearly all
+PROPERTY_CHUNK = 1024
 # search algo inspired by https://github.com/daniellandau/switcher/blob/master/util.js
 
 ### Settings###
 matchFuzzy = False
 orderByRelevancy = True
-DEBUG = False
+maxResults = 50
+windowBackend = "auto"  # "auto" talks to X directly when possible, "wmctrl" never
+DEBUG = False  # time queries and wmctrl calls, the query "stats" shows them
 
 md_iid = "0.5"
 md_version = "0.1"
@@ -37,6 +64,423 @@ md_license = "MIT"
 md_credits = ["Ed Perez", "Manuel Schneider", "dshoreman", "Viet Tran"]
 
 
+class WindowCache:
+    """In-memory snapshot of the window list and the current workspace.
+
+    While a WindowListener is attached the snapshot is trusted until X tells
+    us something changed, so queries don't have to spawn wmctrl. Without a
+    listener every read is a fresh fetch, same as before.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.listener = None
+        self.generation = 0
+        self.snapshot = None
+        self.workspace = None
+
+    def start(self):
+        if Display is None:
+            return
+
+        try:
+            self.listener = WindowListener(self)
+        except Exception:  # no X display reachable, keep fetching per query
+            self.listener = None
+            return
+
+        self.listener.start()
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener.join()
+            self.listener = None
+
+    def listening(self):
+        return self.listener is not None and self.listener.is_alive()
+
+    def stableGeneration(self):
+        """The generation while X events keep the snapshot current, else None"""
+        with self.lock:
+            return self.generation if self.listening() else None
+
+    def windows(self):
+        with self.lock:
+            generation, snapshot = self.generation, self.snapshot
+
+        if snapshot is None or not self.listening():
+            snapshot = self.backend.windows()
+            self.store(generation, snapshot=snapshot)
+
+        return snapshot
+
+    def currentWorkspace(self):
+        with self.lock:
+            generation, workspace = self.generation, self.workspace
+
+        if workspace is None or not self.listening():
+            workspace = self.backend.currentWorkspace()
+            self.store(generation, workspace=workspace)
+
+        return workspace
+
+    def store(self, generation, **values):
+        """Keep fetched values, unless an event invalidated them meanwhile"""
+        with self.lock:
+            if generation == self.generation and self.listening():
+                for attr, value in values.items():
+                    setattr(self, attr, value)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.snapshot = None
+            self.workspace = None
+
+    def invalidateWindows(self):
+        with self.lock:
+            self.generation += 1
+            self.snapshot = None
+
+    def setWorkspace(self, workspace):
+        with self.lock:
+            self.generation += 1
+            self.workspace = workspace
+
+    def updateWindow(self, wid, **fields):
+        with self.lock:
+            if self.snapshot is None:
+                return
+
+            self.generation += 1
+            if not any(w.wid == wid for w in self.snapshot):
+                # left out, like windows on all desktops; fetch it again
+                self.snapshot = None
+                return
+
+            self.snapshot = [
+                w._replace(**fields) if w.wid == wid else w for w in self.snapshot
+            ]
+            # same as the backends, windows on all desktops aren't listed
+            self.snapshot = [w for w in self.snapshot if w.desktop != "-1"]
+
+
+class WindowListener(threading.Thread):
+    """Follows EWMH property changes on the root and client windows"""
+
+    def __init__(self, cache):
+        super().__init__(name="window-switcher-listener", daemon=True)
+        self.cache = cache
+        self.stopped = threading.Event()
+        self.display = Display()
+        self.root = self.display.screen().root
+        self.watched = set()
+
+        atom = self.display.intern_atom
+        self.clientList = atom("_NET_CLIENT_LIST")
+        self.currentDesktop = atom("_NET_CURRENT_DESKTOP")
+        self.wmDesktop = atom("_NET_WM_DESKTOP")
+        self.wmName = atom("_NET_WM_NAME")
+        self.utf8String = atom("UTF8_STRING")
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        try:
+            self.root.change_attributes(event_mask=X.PropertyChangeMask)
+            self.watchClients()
+            self.cache.setWorkspace(self.readDesktop(self.root, self.currentDesktop))
+            self.display.flush()
+
+            while not self.stopped.is_set():
+                if not self.display.pending_events():
+                    select.select([self.display], [], [], 0.5)
+                    continue
+
+                self.handleEvent(self.display.next_event())
+        except Exception:  # lost the connection, the snapshot can't be trusted
+            pass
+        finally:
+            self.cache.invalidate()
+            self.display.close()
+
+    def handleEvent(self, event):
+        if event.type != X.PropertyNotify:
+            return
+
+        if event.window.id == self.root.id:
+            if event.atom == self.clientList:
+                self.watchClients()
+                self.cache.invalidateWindows()
+            elif event.atom == self.currentDesktop:
+                self.cache.setWorkspace(self.readDesktop(self.root, event.atom))
+            return
+
+        wid = "0x%08x" % event.window.id
+        try:
+            if event.atom == self.wmDesktop:
+                self.cache.updateWindow(
+                    wid, desktop=self.readDesktop(event.window, event.atom)
+                )
+            elif event.atom in (self.wmName, Xatom.WM_NAME):
+                self.cache.updateWindow(wid, wm_name=self.readName(event.window))
+        except xerror.XError:  # window went away, the client list will follow
+            pass
+
+    def watchClients(self):
+        """Subscribe to property changes of every managed window"""
+        prop = self.root.get_full_property(self.clientList, Xatom.WINDOW)
+        clients = set(prop.value) if prop else set()
+
+        for wid in clients - self.watched:
+            self.display.create_resource_object("window", wid).change_attributes(
+                event_mask=X.PropertyChangeMask, onerror=lambda *args: None
+            )
+
+        self.watched = clients
+
+    def readDesktop(self, window, atom):
+        prop = window.get_full_property(atom, Xatom.CARDINAL)
+        if not prop:
+            return None
+
+        return str(signed(prop.value[0]))
+
+    def readName(self, window):
+        prop = window.get_full_property(self.wmName, self.utf8String)
+        if not prop:
+            prop = window.get_full_property(Xatom.WM_NAME, X.AnyPropertyType)
+        return decode(prop.value if prop else None) or "N/A"
+
+
+class WmctrlBackend:
+    """Runs wmctrl for every request and parses its output"""
+
+    def __init__(self, stats: QueryStats):
+        self.stats = stats
+
+    def currentWorkspace(self):
+        with self.stats.spawn("wmctrl"):
+            output = subprocess.check_output(["wmctrl", "-d"])
+
+        for line in output.splitlines():
+            cols = line.split()
+            if cols[1].decode() == "*":
+                return cols[0].decode()
+
+        return None
+
+    def windows(self):
+        windows = []
+        with self.stats.spawn("wmctrl"):
+            output = subprocess.check_output(["wmctrl", "-l", "-x"])
+
+        for line in output.splitlines():
+            win = Window(*[token.decode() for token in line.split(None, 4)])
+            if win.desktop != "-1":
+                windows.append(win)
+
+        return windows
+
+    def activate(self, wid):
+        runDetachedProcess(["wmctrl", "-i", "-a", wid])
+
+    def moveToCurrentWorkspace(self, wid):
+        runDetachedProcess(["wmctrl", "-i", "-R", wid])
+
+    def closeWindow(self, wid):
+        runDetachedProcess(["wmctrl", "-i", "-c", wid])
+
+    def close(self):
+        pass
+
+
+class EwmhBackend:
+    """Reads and controls windows through EWMH over one X connection.
+
+    Results are formatted like `wmctrl -l -x` so both backends are
+    interchangeable. Calls come from query and action threads, so every use
+    of the connection goes through the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.display = Display()
+        self.root = self.display.screen().root
+
+        atom = self.display.intern_atom
+        self.netActiveWindow = atom("_NET_ACTIVE_WINDOW")
+        self.netClientList = atom("_NET_CLIENT_LIST")
+        self.netCloseWindow = atom("_NET_CLOSE_WINDOW")
+        self.netCurrentDesktop = atom("_NET_CURRENT_DESKTOP")
+        self.netWmDesktop = atom("_NET_WM_DESKTOP")
+        self.netWmName = atom("_NET_WM_NAME")
+
+    def currentWorkspace(self):
+        with self.lock:
+            desktop = self.readCardinal(self.root.id, self.netCurrentDesktop)
+
+        return None if desktop is None else str(desktop)
+
+    def windows(self):
+        with self.lock:
+            clients = self.requestProperty(self.root.id, self.netClientList)
+            clients = self.replyValue(clients, self.root.id, self.netClientList) or []
+
+            # queue every property of every client, then read the replies:
+            # the whole list costs a single round-trip
+            atoms = (
+                self.netWmDesktop,
+                Xatom.WM_CLASS,
+                Xatom.WM_CLIENT_MACHINE,
+                self.netWmName,
+                Xatom.WM_NAME,
+            )
+            pending = [
+                (wid, [self.requestProperty(wid, atom) for atom in atoms])
+                for wid in clients
+            ]
+
+            windows = []
+            for wid, requests in pending:
+                try:
+                    desktop, wm_class, host, net_name, name = [
+                        self.replyValue(request, wid, atom)
+                        for request, atom in zip(requests, atoms)
+                    ]
+                except xerror.XError:  # closed while we were asking
+                    continue
+
+                desktop = signed(desktop[0]) if desktop else -1
+                if desktop == -1:
+                    continue
+
+                windows.append(
+                    Window(
+                        "0x%08x" % wid,
+                        str(desktop),
+                        ".".join(decode(wm_class).split("\0")[:2]) or "N/A",
+                        decode(host) or "N/A",
+                        decode(net_name or name) or "N/A",
+                    )
+                )
+
+        return windows
+
+    def activate(self, wid):
+        with self.lock:
+            window = int(wid, 16)
+            desktop = self.readCardinal(window, self.netWmDesktop)
+            if desktop is not None and signed(desktop) != -1:
+                self.sendMessage(
+                    self.root.id, self.netCurrentDesktop, [desktop, X.CurrentTime]
+                )
+
+            # source indication 2: request comes from a pager
+            self.sendMessage(window, self.netActiveWindow, [2, X.CurrentTime, 0])
+            self.display.flush()
+
+    def moveToCurrentWorkspace(self, wid):
+        with self.lock:
+            window = int(wid, 16)
+            desktop = self.readCardinal(self.root.id, self.netCurrentDesktop)
+            if desktop is not None:
+                self.sendMessage(window, self.netWmDesktop, [desktop, 2])
+
+            self.sendMessage(window, self.netActiveWindow, [2, X.CurrentTime, 0])
+            self.display.flush()
+
+    def closeWindow(self, wid):
+        with self.lock:
+            self.sendMessage(int(wid, 16), self.netCloseWindow, [X.CurrentTime, 2])
+            self.display.flush()
+
+    def close(self):
+        with self.lock:
+            self.display.close()
+
+    def requestProperty(self, window, atom, offset=0, length=PROPERTY_CHUNK):
+        return xrequest.GetProperty(
+            display=self.display.display,
+            defer=True,
+            delete=False,
+            window=window,
+            property=atom,
+            type=X.AnyPropertyType,
+            long_offset=offset,
+            long_length=length,
+        )
+
+    def replyValue(self, request, window, atom):
+        request.reply()
+        if not request.property_type:
+            return None
+
+        bits, value = request.value
+        if request.bytes_after:
+            # cut at the requested length: ask for the rest, as get_full_property does
+            rest = self.requestProperty(
+                window, atom, len(value) * bits // 32, (request.bytes_after + 3) // 4
+            )
+            value += self.replyValue(rest, window, atom) or value[:0]
+        return value
+
+    def readCardinal(self, window, atom):
+        value = self.replyValue(self.requestProperty(window, atom), window, atom)
+        return value[0] if value else None
+
+    def sendMessage(self, window, atom, data):
+        message = xevent.ClientMessage(
+            window=self.display.create_resource_object("window", window),
+            client_type=atom,
+            data=(32, data + [0] * (5 - len(data))),
+        )
+        self.root.send_event(
+            message, event_mask=X.SubstructureRedirectMask | X.SubstructureNotifyMask
+        )
+
+
+def indexWindow(win):
+    wm_class = win.wm_class.split(".")[-1]
+    description = "%s %s" % (wm_class.lower(), win.wm_name)
+    folded = foldKey(description)
+
+    return IndexEntry(
+        window=win,
+        description=description,
+        folded=folded,
+        # matches at these offsets get the word prefix bonus
+        wordStarts=wordStarts(folded),
+        text="%s: %s" % (win.desktop, wm_class.replace("-", " ")),
+        subtext="%s➜%s" % (wm_class, win.wm_name),
+        sortKey="%s %s" % (wm_class, win.wm_name),
+    )
+
+
+def createBackend(stats: QueryStats):
+    if windowBackend != "wmctrl" and Display is not None:
+        try:
+            return EwmhBackend()
+        except Exception:  # no X display reachable
+            pass
+
+    return WmctrlBackend(stats)
+
+
+def signed(cardinal):
+    """EWMH cardinals as wmctrl prints them, 0xFFFFFFFF is -1"""
+    return cardinal - (1 << 32) if cardinal >= 1 << 31 else cardinal
+
+
+def decode(value):
+    if value is None:
+        return ""
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else value
+
+
 class Plugin(QueryHandler):
     def id(self):
         return md_id
@@ -54,48 +498,77 @@ class Plugin(QueryHandler):
         return "win "
 
     def handleQuery(self, query):
+        self.stats.handleQuery(query, self.addMatchingItems)
+
+    def addMatchingItems(self, query):
         stripped = query.string.strip().lower()
 
         if stripped:
-            curWS = self.getCurrentWorkspace()
-            results = []
-            windows = self.getWindows()
+            # taken before fetching, results are at least as new as it
+            generation = self.windowCache.stableGeneration()
+            with self.stats.phase("fetch"):
+                curWS = self.getCurrentWorkspace()
+
+            try:
+                items = self.results.get(
+                    (stripped, curWS),
+                    generation,
+                    lambda: self.itemsMatching(stripped, curWS, query),
+                )
+            except Cancelled:
+                return
 
-            windows, matchPos = self.filterWindows(stripped, curWS, windows)
-            results = self.createItems(windows, spans=matchPos)
+            query.add(items)
 
-            return results
+    def itemsMatching(self, stripped, curWS, query=None):
+        with self.stats.phase("fetch"):
+            windows = self.getWindows()
+        with self.stats.phase("index"):
+            entries = self.getIndex(windows)
+        with self.stats.phase("match"):
+            entries, matchPos = self.filterWindows(stripped, curWS, entries, query)
+        with self.stats.phase("items"):
+            return self.createItems(entries, spans=matchPos)
+
+    def initialize(self):
+        self.lastFilter = None
+        self.windowIndex = (None, {}, [])
+        self.results = ResultCache()
+        self.stats = QueryStats("window-switcher", DEBUG)
+        self.backend = createBackend(self.stats)
+        self.windowCache = WindowCache(self.backend)
+        self.windowCache.start()
+
+    def finalize(self):
+        self.windowCache.stop()
+        self.backend.close()
+        self.stats.close()
 
     def getCurrentWorkspace(self):
-        for line in subprocess.check_output(["wmctrl", "-d"]).splitlines():
-            cols = line.split()
-            if cols[1].decode() == "*":
-                return cols[0].decode()
-
-        return None
+        return self.windowCache.currentWorkspace()
 
     def getWindows(self):
-        windows = []
+        return self.windowCache.windows()
 
-        for line in subprocess.check_output(["wmctrl", "-l", "-x"]).splitlines():
-            win = Window(*[token.decode() for token in line.split(None, 4)])
-            if win.desktop != "-1":
-                windows.append(win)
+    def getIndex(self, windows):
+        """Search entries for a window snapshot, unchanged windows keep theirs"""
+        indexed, byWindow, entries = self.windowIndex
+        if windows is not indexed:
+            byWindow = {win: byWindow.get(win) or indexWindow(win) for win in windows}
+            entries = list(byWindow.values())
+            self.windowIndex = (windows, byWindow, entries)
 
-        return windows
+        return entries
 
-    def createItems(self, windows, spans=None):
+    def createItems(self, entries, spans=None):
         results = []
 
-        for win in windows:
+        for i, entry in enumerate(entries):
+            win = entry.window
             if spans:
-                text_subtext = self.highlightText(win, spans[win.wid])
+                text_subtext = self.highlightText(entry, spans[i])
             else:
-                text_subtext = {
-                    "text": "%s: %s"
-                    % (win.desktop, win.wm_class.split(".")[-1].replace("-", " ")),
-                    "subtext": "%s➜%s" % (win.wm_class.split(".")[-1], win.wm_name),
-                }
+                text_subtext = {"text": entry.text, "subtext": entry.subtext}
 
             results.append(
                 Item(
@@ -105,17 +578,17 @@ class Plugin(QueryHandler):
                         Action(
                             "switch",
                             "Switch Window",
-                            lambda: runDetachedProcess(["wmctrl", "-i", "-a", win.wid])
+                            lambda wid=win.wid: self.backend.activate(wid),
                         ),
                         Action(
                             "move",
                             "Move window to this desktop",
-                            lambda: runDetachedProcess(["wmctrl", "-i", "-R", win.wid])
+                            lambda wid=win.wid: self.backend.moveToCurrentWorkspace(wid),
                         ),
                         Action(
                             "close",
                             "Close the window gracefully.",
-                            lambda: runDetachedProcess(["wmctrl", "-c", win.wid])
+                            lambda wid=win.wid: self.backend.closeWindow(wid),
                         ),
                     ],
                 )
@@ -123,128 +596,72 @@ class Plugin(QueryHandler):
 
         return results
 
-    def highlightText(self, win, spans: list[tuple[int, int]]):
+    def highlightText(self, entry, spans: list[tuple[int, int]]):
         """
         input:
         spans: list(tuple(int, int)) - describing match positions
         """
+        # the subtext puts a "➜" where the description has a space, offsets agree
+        return {"text": entry.text, "subtext": highlight(entry.subtext, spans)}
 
-        # sort spans
-        spans.sort(key=lambda x: x[0])
-
-        # check spans not overlapping, this could be problem when doing fuzzy search
-        text = "%s: %s" % (win.desktop, win.wm_class.split(".")[-1].replace("-", " "))
-        subtext = ""
-
-        description = "%s➜%s" % (win.wm_class.split(".")[-1], win.wm_name)
-
-        last_pos = 0
-
-        for s_init, s_end in spans:
-            before = description[last_pos:s_init]
-            highlight = description[s_init:s_end]
-
-            subtext += "%s<u>%s</u>" % (before, highlight)
-            last_pos = s_end
-
-        subtext += description[last_pos:]
-        return {"text": text, "subtext": subtext}
-
-    def filterWindows(self, query, curWS, windows):
+    def filterWindows(self, query, curWS, entries, albertQuery=None):
         """if query starts with *, do search on all workspaces
 
+        scoring stops with Cancelled once albertQuery is no longer valid
+
         returns:
-        windows: list[Window(=namedtuple)]
-        spans: dict(window_id:[(match_0_start, match_0_end),...,(match_N_start, match_N_end) ] )
+        entries: list[IndexEntry], best maxResults matches first
+        spans: list[list[(match_start, match_end)]] - match positions per entry
         """
-        if not query or not curWS or not windows:
-            return [w for w in windows if w.desktop == curWS], None
+        self.lastFilter, previous = None, self.lastFilter
+        if not query or not curWS or not entries:
+            return [e for e in entries if e.window.desktop == curWS], None
 
+        rawQuery, allEntries = query, entries
         query = query.split()
         if query[0].startswith("*"):
             query[0] = query[0].strip("*")
             if query[0] == "":  # inserted space after *
                 del query[0]
                 if len(query) == 0:
-                    return windows, None
+                    return entries, None
 
         else:
-            windows = [w for w in windows if w.desktop == curWS]
-
-        # for every window run every query token, add score
-        scores = defaultdict(int)
-        spans = defaultdict(list)
-        for win in windows:
-            wm_class = win.wm_class.split(".")[-1].lower()
-            wm_name = win.wm_name
-            descriptionLowerCase = "%s %s" % (wm_class, wm_name)
-            score = 0
-
-            for query_token in query:
-                score, matchPos = self.calculateScore(descriptionLowerCase, query_token)
-                scores[win.wid] += score
-                spans[win.wid].extend(matchPos)
-
-            # print('score:', scores[win.wid])
-
-        # remove score zero windows and sort
-        windows = [w for w in windows if scores[w.wid] != 0]
+            entries = [e for e in entries if e.window.desktop == curWS]
+
+        # typing on narrows the result: only windows that matched the shorter
+        # query can match the longer one
+        if (
+            previous
+            and previous.curWS == curWS
+            and previous.fuzzy == matchFuzzy
+            and self.narrowsQuery(previous.query, rawQuery)
+            and previous.entries == allEntries
+        ):
+            entries = previous.hits
+
+        scores, spans = self.scoreEntries(entries, query, albertQuery)
+        hits = [entry for entry, matchPos in zip(entries, spans) if matchPos]
+        self.lastFilter = FilterState(rawQuery, curWS, matchFuzzy, allEntries, hits)
+
+        # keep the best of the windows that matched
         if orderByRelevancy:
-            windows.sort(key=lambda x: scores[x.wid], reverse=True)
+            ranked = top(scores, spans, maxResults)
         else:
-            windows.sort(
-                key=lambda x: "%s %s" % (x.wm_class.split(".")[-1], x.wm_name),
-                reverse=True,
-            )
-        spans = {wid: sp for wid, sp in spans.items() if scores[wid] != 0}
-        # [print(w.wm_name, scores[w.wid]) for w in windows]
-        return windows, spans
-
-    def calculateScore(self, description, query_token):
-        if query_token == "":
-            return True
-        regexp = self.createRegExp(query_token)
-        # print(regex)
-
-        score = 0
-        spans = []
-
-        for match in re.finditer(regexp, description, flags=re.I):
-            # print('%s -> matches: %s'%(regexp, match))
-            # A full match at the beginning is the best match
-            if match.start() == 0 and len(match.group(0)) == len(query_token):
-                score += 100
-
-            # matches at beginning word boundaries are better than in the middle of words
-            if match.start() == 0 or (
-                match.start != 0 and description[match.start() - 1] == " "
-            ):
-                wordPrefixFactor = 1.2
-            else:
-                wordPrefixFactor = 0.0
-
-            # matches nearer to the beginning are better than near the end
-            precedenceFactor = 1.0 / (1 + match.start())
+            ranked = (i for i, matchPos in enumerate(spans) if matchPos)
+            ranked = heapq.nlargest(maxResults, ranked, key=lambda i: entries[i].sortKey)
 
-            # fuzzyness can cause lots of stuff to match, penalize by match length
-            fuzzynessFactor = (2.3 * (len(query_token) - len(match.group(0)))) / len(
-                match.group(0)
-            )
+        return [entries[i] for i in ranked], [spans[i] for i in ranked]
 
-            # join factors by summing
-            newscore = precedenceFactor + wordPrefixFactor + fuzzynessFactor
-            score = max(score, newscore)
-            spans.append(match.span())
+    def scoreEntries(self, entries, query, albertQuery=None):
+        """Scores all entries one query token at a time, summing over tokens"""
+        corpus = Corpus([e.folded for e in entries], [e.wordStarts for e in entries])
+        return Matcher(" ".join(query), matchFuzzy).scoreAll(corpus, albertQuery)
 
-        return score, spans
-
-    def createRegExp(self, query_token):
-        regex = ""
-        if matchFuzzy:
-            query_token = [re.escape(x) for x in list(query_token)]
-        else:
-            query_token = [re.escape(query_token)]
+    def narrowsQuery(self, previous, query):
+        """True if query only appends to the last token of the previous query"""
+        # after a trailing space the next character starts a new token
+        if not query.startswith(previous) or previous[-1:].isspace():
+            return False
 
-        regex = reduce(lambda a, b: a + "[^" + b + "]*" + b, query_token)
-        # print(regex)
-        return regex
+        return not any(c.isspace() for c in query[len(previous) :])
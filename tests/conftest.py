@@ -0,0 +1,9 @@
+"""The plugins load as in the benchmarks, against bench's stub albert module."""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT / "bench", ROOT / "python/plugins"):
+    if str(path) not in sys.path:
+        sys.path.append(str(path))
@@ -0,0 +1,235 @@
+"""Bookmarks searched in memory and through the SQLite sidecar."""
+
+import csv
+import os
+import random
+import sqlite3
+
+import pytest
+from harness import loadPlugin
+
+bm = loadPlugin("bookmarks")
+
+HEADER = ["id", "name", "url", "tags", "desc"]
+
+
+@pytest.fixture(autouse=True)
+def noBackgroundReloads(monkeypatch):
+    """Stores are reloaded by the tests alone"""
+    monkeypatch.setattr(bm, "RELOAD_CHECK_INTERVAL", float("inf"))
+    monkeypatch.setattr(bm.Reloader, "refresh", lambda self: None)
+
+
+def writeCsv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def loaded(store):
+    store.reload()
+    return store
+
+
+def ids(store, search, limit=50):
+    return [b.id for b in store.best(bm.BookmarkQuery.parse(search), limit)]
+
+
+def test_fields_spanning_lines_match_as_one_line(tmp_path):
+    path = tmp_path / "bookmarks.csv"
+    writeCsv(
+        path,
+        [
+            ["1", "line one\nline two", "https://multi.example/a\nb", "x\ny", ""],
+            ["2", "other", "https://two.example", "", ""],
+        ],
+    )
+    memory = loaded(bm.BookmarkStore(str(path)))
+    sidecar = loaded(bm.BookmarkDatabase(str(path)))
+
+    for search, expected in [
+        ("name:two", ["1"]),
+        ("url:multi", ["1"]),
+        ('name:"one line"', ["1"]),
+        ("tag:y", ["1"]),
+        ("two", ["1", "2"]),  # in the name ranks above in the url
+    ]:
+        assert ids(memory, search) == expected, search
+        assert ids(sidecar, search) == expected, search
+
+    assert memory.index.bookmarks[0].rank("two") == bm.RANK_NAME
+
+
+WORDS = "python rust kernel memory leak video talk github release notes how to".split()
+HOSTS = ["github.com", "lwn.net", "youtube.com", "docs.python.org", "news.ycombinator.com"]
+SEARCHES = [
+    "",
+    "p",
+    "py",
+    "python",
+    "rust kernel",
+    '"memory leak"',
+    "lwn.net",
+    "zzz",
+    "tag:video",
+    "tag:video tag:talk",
+    "tag:rust py",
+    "url:github",
+    "name:ke",
+    "name:python tag:talk",
+    "url:docs name:re",
+    "tag:nope",
+    "https://github.com",
+    "how to",
+]
+
+
+def randomRows(rng, count, start=0):
+    return [
+        [
+            str(start + i),
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))).capitalize(),
+            f"https://{rng.choice(HOSTS)}/{rng.choice(WORDS)}/{start + i}",
+            " ".join(rng.sample(["rust", "python", "video", "talk", "paper"], rng.randint(0, 2))),
+            "",
+        ]
+        for i in range(count)
+    ]
+
+
+def rewrite(path, rows):
+    """Writes rows, with a stamp that surely differs from the last one"""
+    before = path.stat().st_mtime_ns if path.exists() else 0
+    writeCsv(path, rows)
+    os.utime(path, ns=(before + 10**9, before + 10**9))
+
+
+def assertSameResults(sidecar, path):
+    memory = loaded(bm.BookmarkStore(str(path)))
+    for search in SEARCHES:
+        for limit in (5, 50):
+            assert ids(sidecar, search, limit) == ids(memory, search, limit), search
+
+
+@pytest.mark.parametrize("probeRows", [10**6, 40])  # probe finds them all, or falls back
+def test_sidecar_ranks_like_memory_through_changes(tmp_path, monkeypatch, probeRows):
+    monkeypatch.setattr(bm.BookmarkDatabase, "PROBE_ROWS", probeRows)
+    rng = random.Random(7)
+    path = tmp_path / "bookmarks.csv"
+    rows = randomRows(rng, 400)
+    rewrite(path, rows)
+    sidecar = loaded(bm.BookmarkDatabase(str(path)))
+    assertSameResults(sidecar, path)
+
+    changes = [
+        lambda: rows[-1].__setitem__(1, "Edited python name"),  # edit
+        lambda: rows[5].__setitem__(3, "video rust"),  # retag
+        lambda: rows.append(rows.pop(10)),  # move
+        lambda: rows.pop(0),  # delete, every row moves up
+        lambda: rows.insert(0, ["new", "Python kernel", "https://lwn.net/x", "talk", ""]),
+        lambda: rng.shuffle(rows),
+        lambda: rows.extend(randomRows(rng, 50, start=1000)),
+    ]
+    for change in changes:
+        change()
+        rewrite(path, rows)
+        sidecar.reload()
+        assertSameResults(sidecar, path)
+
+
+def test_sidecar_opened_again_needs_no_sync(tmp_path):
+    path = tmp_path / "bookmarks.csv"
+    rewrite(path, randomRows(random.Random(8), 100))
+    first = bm.BookmarkDatabase(str(path))
+    other = bm.BookmarkDatabase(str(path))  # another Albert, not synced yet
+    loaded(first)
+
+    statements = []
+    connect = other.connect
+
+    def tracedConnect():
+        db = connect()
+        db.set_trace_callback(statements.append)
+        return db
+
+    other.connect = tracedConnect
+    loaded(other)
+
+    assert other.stamp == first.stamp
+    assert not [s for s in statements if s.split()[0] in ("INSERT", "UPDATE", "DELETE")]
+    assertSameResults(other, path)
+
+
+def test_parse_splits_fields_and_quoted_values():
+    query = bm.BookmarkQuery.parse('"Memory Leak" name:"a b" TAG:Video url:"unterminated')
+    assert query == bm.BookmarkQuery(
+        words=("memory leak",), names=("a b",), urls=("unterminated",), tags=("video",)
+    )
+
+
+def test_parse_keeps_urls_and_unknown_prefixes_as_words():
+    assert bm.BookmarkQuery.parse("https://github.com foo:bar").words == (
+        "https://github.com",
+        "foo:bar",
+    )
+
+
+def test_parse_ignores_a_field_still_being_typed():
+    assert bm.BookmarkQuery.parse("py tag:") == bm.BookmarkQuery.parse("py")
+    assert not bm.BookmarkQuery.parse('tag: name:""')
+
+
+def test_tags_intersect_and_must_be_whole_tags():
+    rows = [
+        bm.Bookmark("1", "a", "https://a", "rust,video", ""),
+        bm.Bookmark("2", "b", "https://b", "rust talk", ""),
+        bm.Bookmark("3", "c", "https://c", "video rust-lang", ""),
+        bm.Bookmark("4", "d", "https://d", "Rust Video talk", ""),
+    ]
+    index = bm.BookmarkIndex.build(rows)
+    unindexed = bm.BookmarkIndex(rows)
+
+    for search, expected in [
+        ("tag:rust", ["1", "2", "4"]),
+        ("tag:rust tag:video", ["1", "4"]),
+        ("tag:video tag:talk tag:rust", ["4"]),
+        ("tag:rust-lang", ["3"]),
+        ("tag:rus", []),
+        ("tag:rust b", ["2"]),
+    ]:
+        query = bm.BookmarkQuery.parse(search)
+        assert [b.id for b in index.search(query)] == expected, search
+        assert [b.id for b in unindexed.search(query)] == expected, search
+
+
+def test_intersect_rarest():
+    small, large = [2, 5, 9], list(range(100))
+    assert bm.intersectRarest([]) is None
+    assert bm.intersectRarest([large]) is large
+    # much larger postings aren't walked, the candidates are checked instead
+    assert bm.intersectRarest([large, small]) is small
+    assert bm.intersectRarest([[1, 2, 5, 7], small]) == [2, 5]
+
+
+def test_shards_of_dropped_files_are_closed(tmp_path):
+    for name in ["a.csv", "b.csv"]:
+        writeCsv(tmp_path / name, [[name, "python " + name, "https://x.example", "", ""]])
+    sources = loaded(bm.BookmarkSources([str(tmp_path)]))
+    shards = dict(sources.shards)
+    for store in shards.values():
+        store.reload()
+    assert ids(sources, "python") == ["a:a.csv", "b:b.csv"]
+
+    os.remove(tmp_path / "b.csv")
+    loaded(sources)
+    dropped = shards[str(tmp_path / "b.csv")]
+    assert ids(sources, "python") == ["a.csv"]
+    # as seen by a query that got the shard before the reload
+    assert ids(dropped, "python") == []
+    with pytest.raises(sqlite3.ProgrammingError):
+        dropped.db.execute("SELECT 1")
+
+    sources.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        shards[str(tmp_path / "a.csv")].db.execute("SELECT 1")
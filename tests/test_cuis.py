@@ -0,0 +1,120 @@
+"""Ranking Cuis images by regex passes, against sorting every match."""
+
+import heapq
+import random
+
+from harness import loadPlugin
+
+cuis = loadPlugin("cuis")
+
+ROOT = "/images"
+
+
+def startsSegment(search, key):
+    return any(
+        key.startswith(search, i) and (i == 0 or key[i - 1] in cuis.SEGMENT_SEPARATORS)
+        for i in range(len(key))
+    )
+
+
+def isSubsequence(search, key):
+    pos = -1
+    for c in search:
+        pos = key.find(c, pos + 1)
+        if pos < 0:
+            return False
+    return True
+
+
+def bruteRank(search, key):
+    """The rank of an image's key for search, see rankPatterns, None if no match.
+
+    Tier 0 is the name starting with search, or with slashes in it, the last
+    directories and the name.
+    """
+    words = search.split()
+    if any(
+        key.startswith(search, i)
+        and (i == 0 or key[i - 1] == "/")
+        and "/" not in key[i + len(search) :]
+        for i in range(len(key))
+    ):
+        return 0
+    if startsSegment(search, key):
+        return 1
+    if search in key:
+        return 2
+    if len(words) > 1 and all(startsSegment(word, key) for word in words):
+        return 3
+    if len(words) > 1 and all(word in key for word in words):
+        return 4
+    if all(isSubsequence(word, key) for word in words):
+        return 5
+    return None
+
+
+def images(count=3000):
+    rng = random.Random(3)
+    parts = ["c1", "p2", "tp3", "img", "m-0", "z_9", "final.v2", "old copy"]
+    parts += ["backup", "upload"]  # "up" starting a segment or not
+    paths = {
+        "/".join(rng.choice(parts) for _ in range(rng.randint(1, 4)))
+        for _ in range(count)
+    }
+    return [
+        cuis.Image(path, cuis.imageKey(ROOT, path), 0, 0)
+        for path in (f"{ROOT}/{p}{cuis.IMAGE_EXT}" for p in sorted(paths))
+    ]
+
+
+def test_best_matches_a_brute_force_ranking():
+    listed = images()
+    imageList = cuis.ImageList(listed, {})
+    rng = random.Random(4)
+    searches = ["c1/p2", "/", "final", "v2", "tp3 ", "img final", "up old", "y o"] + [
+        "".join(rng.choice("cpimtzu0123/_-. ") for _ in range(rng.randint(1, 6)))
+        for _ in range(400)
+    ]
+
+    for search in searches:
+        ranked = [
+            (rank, len(image.key), image.path)
+            for image in listed
+            if (rank := bruteRank(search, image.key)) is not None
+        ]
+        for limit in (30, len(listed)):
+            expected = [path for *_, path in heapq.nsmallest(limit, ranked)]
+            assert imageList.best(search, limit) == expected, (search, limit)
+
+
+def test_unknown_characters_match_nothing():
+    assert cuis.ImageList(images(), {}).best("img#", 30) == []
+
+
+def test_empty_search_lists_alphabetically():
+    listed = images()
+    assert cuis.ImageList(listed, {}).best("", 30) == sorted(i.path for i in listed)[:30]
+
+
+def test_overlapping_roots_list_each_image_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(cuis, "OPENED_FILE", str(tmp_path / "opened.json"))
+    for path in ["a/x.image", "a/b/y.image", "c/z.image"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).touch()
+    roots = [f"{tmp_path}/a/", f"{tmp_path}/a/b", f"{tmp_path}/c", f"{tmp_path}//c/."]
+
+    catalog = cuis.ImageCatalog(roots)
+    catalog.scan()
+
+    listed = catalog.images.best("", 10)
+    assert sorted(listed) == [
+        f"{tmp_path}/a/b/y.image",
+        f"{tmp_path}/a/x.image",
+        f"{tmp_path}/c/z.image",
+    ]
+    assert [catalog.rootOf(path) for path in sorted(listed)] == [
+        f"{tmp_path}/a",
+        f"{tmp_path}/a",
+        f"{tmp_path}/c",
+    ]
+    assert catalog.images.best("b/y", 10) == [f"{tmp_path}/a/b/y.image"]
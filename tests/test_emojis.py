@@ -0,0 +1,140 @@
+"""Emoji usage stats on disk and the label index."""
+
+import heapq
+import json
+import pickle
+import random
+
+import pytest
+from harness import loadPlugin
+
+emojis = loadPlugin("emojis")
+
+
+@pytest.fixture(autouse=True)
+def statsFiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(emojis, "stats_path", tmp_path / "stats.json")
+    monkeypatch.setattr(emojis, "stats_log_path", tmp_path / "stats.log")
+    monkeypatch.setattr(emojis, "legacy_stats_path", tmp_path / "stats")
+    monkeypatch.setattr(emojis, "stats_half_life", None)
+    return tmp_path
+
+
+def writeSnapshot(scores, log):
+    emojis.stats_path.write_text(json.dumps({"epoch": 0.0, "log": log, "scores": scores}))
+
+
+def loadedStats():
+    stats = emojis.UsageStats()
+    stats.load()
+    return stats
+
+
+def test_load_replays_the_log_of_the_snapshot():
+    writeSnapshot({"😀": 2.0}, log=3)
+    emojis.stats_log_path.write_text("log 3\n1.0\t😀\n2.0\t🙏\n")
+    assert loadedStats().scores == {"😀": 3.0, "🙏": 1.0}
+
+
+def test_load_ignores_a_log_of_another_snapshot():
+    writeSnapshot({"😀": 2.0}, log=3)
+    emojis.stats_log_path.write_text("log 2\n1.0\t😀\n")
+    assert loadedStats().scores == {"😀": 2.0}
+
+
+def test_load_skips_a_torn_last_line():
+    writeSnapshot({}, log=0)
+    emojis.stats_log_path.write_text("log 0\n1.0\t😀\n2.0")
+    assert loadedStats().scores == {"😀": 1.0}
+
+
+def test_legacy_pickle_is_taken_over():
+    emojis.legacy_stats_path.write_bytes(pickle.dumps({"😀": 5, "🙏": 2}))
+    stats = loadedStats()
+
+    assert stats.scores == {"😀": 5.0, "🙏": 2.0}
+    assert stats.top == ["😀", "🙏"]
+    assert not emojis.legacy_stats_path.exists()
+    assert loadedStats().scores == stats.scores
+
+
+def test_copies_survive_a_restart_and_count_once():
+    stats = loadedStats()
+    stats.start()
+    for emoji in ["😀", "😀", "🙏", "😀"]:
+        stats.add(emoji)
+    stats.stop()  # flushes and compacts
+
+    assert loadedStats().scores == {"😀": 3.0, "🙏": 1.0}
+
+
+def test_a_crash_after_the_snapshot_counts_nothing_twice(monkeypatch):
+    stats = loadedStats()
+    stats.flush([(1.0, "😀"), (2.0, "🙏")])
+    assert loadedStats().scores == {"😀": 1.0, "🙏": 1.0}
+
+    def crash():
+        raise OSError("killed before the new log")
+
+    # the snapshot now holds the logged copies, the old log is still there
+    monkeypatch.setattr(stats, "new_log", crash)
+    with pytest.raises(OSError):
+        stats.compact()
+
+    assert loadedStats().scores == {"😀": 1.0, "🙏": 1.0}
+
+
+@pytest.mark.parametrize("halfLife", [None, 0.5])
+def test_top_stays_the_most_used(monkeypatch, halfLife):
+    monkeypatch.setattr(emojis, "stats_half_life", halfLife)
+    now = iter(range(10**9))
+    monkeypatch.setattr(emojis.time, "time", lambda: 1000.0 + next(now) * 3600)
+    rng = random.Random(5)
+    stats = emojis.UsageStats()
+
+    for _ in range(2000):
+        # a few favourites, and a long tail
+        stats.add(rng.choice("abcdef") if rng.random() < 0.6 else str(rng.randrange(200)))
+        expected = heapq.nlargest(emojis.recent_count, stats.scores, key=stats.scores.get)
+        assert [stats.scores[e] for e in stats.top] == [stats.scores[e] for e in expected]
+
+
+LABELS = [
+    "smiling_face_with_halo", "grinning_cat", "Smile", "smiley", "smile_cat",
+    "cat_smile", "sweat_smile", "slightly_smiling_face", "sunglasses", "smirk",
+]
+
+
+def labelsFound(index, search, limit=20):
+    return [index.labels[i] for i in index.search(search, limit)]
+
+
+def test_exact_label_then_prefix_hits_then_fuzzy_ones():
+    found = labelsFound(emojis.LabelIndex.build(LABELS), "smile")
+
+    assert found[:3] == ["Smile", "smiley", "smile_cat"]
+    assert set(found[3:5]) == {"cat_smile", "sweat_smile"}
+    assert "smiling_face_with_halo" not in found[:5]
+
+
+def test_words_are_joined_like_the_labels():
+    found = labelsFound(emojis.LabelIndex.build(LABELS), "Smiling  Face")
+    assert found[0] == "smiling_face_with_halo"
+
+
+def test_a_mistyped_letter_still_finds_the_label():
+    assert "Smile" in labelsFound(emojis.LabelIndex.build(LABELS), "smole")
+
+
+def test_prefix_hits_are_the_shortest_labels_starting_with_the_search():
+    rng = random.Random(9)
+    labels = sorted({"".join(rng.choices("abc_", k=rng.randint(1, 8))) for _ in range(500)})
+    index = emojis.LabelIndex.build(labels)
+
+    for search in ["a", "ab", "b_c", "cc", "abca"]:
+        prefixed = [label for label in labels if label.startswith(search)]
+        found = labelsFound(index, search, limit=10)
+        assert sorted(map(len, found[: len(prefixed)]))[:10] == sorted(map(len, prefixed))[:10]
+        assert set(found[: len(prefixed)]) <= set(prefixed)
+        if search in labels:
+            assert found[0] == search
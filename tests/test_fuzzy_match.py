@@ -0,0 +1,81 @@
+"""fuzzyMatch and substringMatch against brute force over every alignment."""
+
+import itertools
+import random
+
+import pytest
+
+from plugin_common.matching import (
+    FULL_MATCH,
+    FUZZY_PENALTY,
+    WORD_START_BONUS,
+    fuzzyMatch,
+    substringMatch,
+    wordStarts,
+)
+
+ALPHABET = "abc _-"
+
+
+def alignmentScore(positions, size, starts):
+    start, length = positions[0], positions[-1] + 1 - positions[0]
+    if start == 0 and length == size:
+        return FULL_MATCH
+    return (
+        1.0 / (1 + start)
+        + (WORD_START_BONUS if start in starts else 0.0)
+        + (FUZZY_PENALTY * (size - length)) / length
+    )
+
+
+def bruteFuzzy(key, starts, token):
+    """Best score over every placement of token's characters in key, in order"""
+    best = None
+    for positions in itertools.combinations(range(len(key)), len(token)):
+        if all(key[i] == c for i, c in zip(positions, token)):
+            score = alignmentScore(positions, len(token), starts)
+            best = score if best is None else max(best, score)
+    return best
+
+
+def randomKeys(seed, count):
+    rng = random.Random(seed)
+    for _ in range(count):
+        key = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 10)))
+        token = "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+        yield key, token
+
+
+@pytest.mark.parametrize("separators", [" ", " _-"])
+def test_fuzzy_match_finds_the_best_alignment(separators):
+    for key, token in randomKeys(1, 3000):
+        starts = wordStarts(key, separators)
+        score, spans = fuzzyMatch(key, starts, token, separators)
+        expected = bruteFuzzy(key, starts, token)
+
+        if expected is None:
+            assert spans == []
+            continue
+
+        assert score == pytest.approx(max(expected, 0)), (key, token)
+        positions = [i for start, end in spans for i in range(start, end)]
+        assert "".join(key[i] for i in positions) == token
+        assert alignmentScore(positions, len(token), starts) == pytest.approx(expected)
+
+
+def test_substring_match_scores_the_best_occurrence():
+    for key, token in randomKeys(2, 3000):
+        starts = wordStarts(key)
+        score, spans = substringMatch(key, starts, token)
+        found = [i for i in range(len(key)) if key.startswith(token, i)]
+
+        # occurrences, not overlapping, and every other one overlaps them
+        assert all(key[start:end] == token for start, end in spans)
+        assert all(a[1] <= b[0] for a, b in zip(spans, spans[1:]))
+        assert all(any(start <= i < end for start, end in spans) for i in found)
+        if found:
+            assert score == pytest.approx(
+                max(alignmentScore(range(i, i + len(token)), len(token), starts) for i in found)
+            )
+        else:
+            assert (score, spans) == (0, [])
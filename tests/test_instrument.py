@@ -0,0 +1,37 @@
+"""Query stats, written to disk away from the queries."""
+
+import json
+import threading
+
+from plugin_common import instrument
+
+
+def test_stats_are_flushed_off_the_query_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrument, "STATS_DIR", str(tmp_path))
+    monkeypatch.setattr(instrument, "FLUSH_INTERVAL", 0.0)
+    stats = instrument.QueryStats("test", enabled=True)
+    stats.path = str(tmp_path / "test.json")
+
+    flushed, flush = threading.Event(), stats.flush
+    flushers = []
+
+    def recordingFlush():
+        flushers.append(threading.current_thread())
+        flush()
+        flushed.set()
+
+    monkeypatch.setattr(stats, "flush", recordingFlush)
+    with stats.query():
+        with stats.phase("match"):
+            pass
+
+    assert flushed.wait(5)
+    assert flushers[0] is not threading.current_thread()
+    assert json.loads((tmp_path / "test.json").read_text())["queries"] == 1
+
+    monkeypatch.setattr(instrument, "FLUSH_INTERVAL", float("inf"))
+    with stats.query():
+        pass
+    stats.close()  # written right away, on the closing thread
+    assert flushers[1:] == [threading.current_thread()]
+    assert json.loads((tmp_path / "test.json").read_text())["queries"] == 2
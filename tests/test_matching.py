@@ -0,0 +1,45 @@
+"""The shared matching engine: scoring a corpus, folding keys, highlighting."""
+
+import random
+
+from plugin_common.matching import Corpus, Matcher, foldKey, highlight, matchKey, top
+
+
+def test_score_all_agrees_with_score():
+    texts = ["Firefox GitHub pull", "kitty vim", "gh-pages pull request", "Slack"]
+    corpus = Corpus.build(texts)
+    for search in ["gh pull", "ki vi", "s", "zzz", "pull"]:
+        for fuzzy in (False, True):
+            matcher = Matcher(search, fuzzy)
+            scores, spans = matcher.scoreAll(corpus)
+            assert list(zip(scores, spans)) == [
+                matcher.score(key, starts) for key, starts in zip(*corpus)
+            ]
+
+
+def test_top_is_the_best_of_sorting_every_match():
+    rng = random.Random(2)
+    texts = ["".join(rng.choices("abc ", k=rng.randint(1, 12))) for _ in range(500)]
+    corpus = Corpus.build(texts)
+    for search in ["a", "ab c", "cab", "bb", "abcabc"]:
+        scores, spans = Matcher(search, fuzzy=True).scoreAll(corpus)
+        # sorted is stable, ties stay in corpus order
+        matched = sorted(
+            (i for i in range(len(texts)) if spans[i]), key=lambda i: -scores[i]
+        )
+        for k in (0, 1, 10, len(texts)):
+            assert top(scores, spans, k) == matched[:k]
+
+
+def test_fold_key_keeps_offsets():
+    assert foldKey("İstanbul ÉTÉ") == "İstanbul été"
+
+
+def test_match_key_folds_and_notes_word_starts():
+    assert matchKey("Tp3/Final-v2", "/-") == ("tp3/final-v2", frozenset({0, 4, 10}))
+
+
+def test_highlight_merges_overlapping_spans_and_escapes():
+    assert highlight("a<b>c", [(1, 3), (2, 4)]) == "a<u>&lt;b&gt;</u>c"
+    assert highlight("dir/name", [(0, 2)], offset=4) == "dir/<u>na</u>me"
+    assert highlight("<plain>", []) == "<plain>"
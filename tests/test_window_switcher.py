@@ -0,0 +1,48 @@
+"""Narrowing the previous matches as the query grows, against a full rescore."""
+
+import random
+
+import pytest
+from harness import loadPlugin, typed
+
+ws = loadPlugin("window-switcher")
+
+WORDS = (
+    "github pull request review issue firefox mozilla private browsing youtube"
+    " watch docs python stack overflow kitty vim terminal slack Fix-Bug foo.bar_baz"
+).split()
+SEARCHES = ["firefox", "*gh pull", "* py", "kitty vim", "pllrqst", "*fix bug", "foo bar", "zzz"]
+
+
+def entries(count=800):
+    rng = random.Random(1)
+    classes = ["n.Firefox", "k.kitty", "s.Slack", "x.gnome-terminal"]
+    return [
+        ws.indexWindow(
+            ws.Window(
+                hex(i),
+                str(rng.randint(0, 2)),
+                rng.choice(classes),
+                "host",
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 8))),
+            )
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize("fuzzy", [False, True])
+@pytest.mark.parametrize("byRelevancy", [False, True])
+def test_narrowing_matches_a_full_rescore(monkeypatch, fuzzy, byRelevancy):
+    monkeypatch.setattr(ws, "matchFuzzy", fuzzy)
+    monkeypatch.setattr(ws, "orderByRelevancy", byRelevancy)
+    windows = entries()
+    typing, fresh = ws.Plugin(), ws.Plugin()
+    typing.lastFilter = None
+
+    for search in SEARCHES:
+        for query in typed(search):
+            fresh.lastFilter = None
+            assert typing.filterWindows(query, "1", windows) == fresh.filterWindows(
+                query, "1", windows
+            ), query